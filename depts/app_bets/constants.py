@@ -6,6 +6,7 @@
 2. Анализ матчей
 3. Парсинг данных
 4. Сообщения и тексты
+5. Кэширование
 """
 
 from decimal import Decimal
@@ -112,6 +113,14 @@ class ParsingConstants:
         'SC0': 'Премьер Лига',
     }
 
+    # ==================== ИМПОРТ CSV ====================
+    CSV_IMPORT_COLUMNS = (
+        'Div', 'Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG',
+        'AvgH', 'AvgD', 'AvgA', 'B365H', 'B365D', 'B365A', 'PSH', 'PSD', 'PSA',
+    )  # Колонки football-data.co.uk, которые читает импорт
+    CSV_BULK_BATCH_SIZE = 1000  # Размер пачки для bulk_create при импорте матчей
+    CSV_READ_WORKERS = 4  # Потоков для параллельного чтения файлов при синхронизации папки
+
 
 class Messages:
     """
@@ -137,4 +146,27 @@ class Messages:
     # ==================== ЛОГИРОВАНИЕ ====================
     ALIAS_CREATED = "Создан/обновлен алиас: {} → team_id={}"
     MATCH_FOUND = "Найден матч: {} - {} ({}/{}/{})"
-    TOTAL_MATCHES = "Всего найдено матчей: {}"
\ No newline at end of file
+    TOTAL_MATCHES = "Всего найдено матчей: {}"
+
+
+class CacheConstants:
+    """
+    Ключи и время жизни записей в кэше Django.
+    """
+
+    # ==================== СПИСОК КОМАНД ====================
+    ALL_TEAMS_KEY = 'bets:all_teams_sorted'  # Отсортированный список команд для выпадающих списков
+    # Кэш в памяти каждого процесса: сигнал сбрасывает только воркер, сохранивший команду,
+    # остальные воркеры видят новый список не позже чем через этот интервал
+    ALL_TEAMS_TIMEOUT = 60  # 1 минута
+
+    # ==================== КОДЫ ЛИГ ====================
+    LEAGUE_CODES_KEY = 'bets:league_codes'  # Название лиги (и с страной) -> external_id для калибровки
+    # Как и список команд, живёт в памяти процесса: другие воркеры обновляются по таймауту
+    LEAGUE_CODES_TIMEOUT = 60  # 1 минута
+
+    # ==================== РЕЗУЛЬТАТЫ АНАЛИЗА ====================
+    ANALYSIS_CACHE_ALIAS = 'analysis'  # Общий для воркеров кэш результатов (settings.CACHES)
+    ANALYSIS_RESULTS_KEY = 'bets:analysis:{}'  # Результаты анализа текста, ключ хранится в сессии
+    ANALYSIS_RESULTS_TIMEOUT = 60 * 60 * 24  # 24 часа
+    CLEANED_RESULTS_KEY = 'bets:cleaned:{}'  # Результаты очищенного анализа ТБ/ТМ 2.5, тот же ключ сессии
@@ -0,0 +1,465 @@
+"""
+Импорт матчей из CSV-файлов football-data (колонки Div, Date, HomeTeam, AwayTeam, ...).
+
+Логика общая для загрузки через UploadCSVView и для management-команд
+(sync_import_data, import_second_matches), поэтому не зависит от HTTP-запроса.
+"""
+import io
+import os
+import re
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import accumulate
+from typing import Dict
+
+import pandas as pd
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.timezone import get_current_timezone
+
+from app_bets.constants import ParsingConstants, Messages
+from app_bets.models import Team, TeamAlias, Season, Match, League
+
+# Шаблон округления коэффициентов (создается один раз, а не на каждую строку)
+ODDS_QUANT = Decimal(Messages.DECIMAL_FORMAT)
+# Коэффициент по умолчанию для пустых/нераспознанных значений при импорте CSV
+ODD_DEFAULT = Decimal('1.01')
+# Строки длиннее этого порога чистятся без кэша (названия команд короче)
+TEAM_NAME_CACHE_MAX_LENGTH = 256
+# Символы, удаляемые из названий команд при импорте CSV
+IMPORT_NAME_STRIP_RE = re.compile(r'[^\w\s]')
+
+
+@lru_cache(maxsize=4096)
+def normalize_alias(name: str) -> str:
+    """Ключ алиаса как в TeamAlias.save: схлопнутые пробелы и нижний регистр."""
+    return " ".join(name.split()).lower()
+
+
+@lru_cache(maxsize=4096)
+def _clean_import_team_name(name: str) -> str:
+    """Очистка названия команды из CSV (названия повторяются из строки в строку)."""
+    return IMPORT_NAME_STRIP_RE.sub('', normalize_alias(name))
+
+
+# ==================== ЧТЕНИЕ CSV ПО ПОЗИЦИЯМ ====================
+# Команды импорта читают строки csv.reader вместо DictReader: индексы колонок
+# берутся из заголовка один раз, словарь на каждую строку не строится.
+
+def csv_columns(header) -> Dict[str, int]:
+    """Индексы колонок по заголовку; при повторе имени побеждает последняя колонка, как в DictReader."""
+    return {name: index for index, name in enumerate(header)}
+
+
+def csv_rows(reader):
+    """Строки csv.reader без пустых, как их пропускает DictReader."""
+    return (row for row in reader if row)
+
+
+def csv_cell(row, columns, name, default=None):
+    """
+    Значение колонки name из строки csv.reader.
+    Нет колонки в заголовке — default, короткая строка — None (как у DictReader).
+    """
+    index = columns.get(name)
+    if index is None:
+        return default
+    return row[index] if index < len(row) else None
+
+
+class MatchCSVImporter:
+    """
+    Импорт файла CSV в Match: чтение pandas, подбор лиги, сезона и команд,
+    проверка и запись пачками через bulk_create. Результат — словарь счетчиков.
+    """
+
+    @transaction.atomic
+    def process_csv_file(self, source, frame=None):
+        """
+        Импорт матчей из CSV. source — путь к файлу или бинарный
+        file-like объект (например, загруженный UploadedFile).
+        frame — уже прочитанный load_csv_frame(source), если есть.
+        """
+        count = 0
+        skipped = 0
+        errors = 0
+        processed = 0
+        created_aliases = 0
+        unknown_teams_list = []
+        # Матчи копятся пачкой и пишутся через bulk_create вместо INSERT на строку
+        to_create = []
+
+        # Справочники загружаются один раз на файл, в цикле только словари
+        # (для команд нужны только id: матчи собираются через home_team_id/away_team_id)
+        team_sports = {}
+        all_teams_by_name = {}
+        for team_id, name, sport_id in Team.objects.values_list('id', 'name', 'sport_id'):
+            team_sports[team_id] = sport_id
+            all_teams_by_name[name.lower()] = team_id
+        all_aliases = dict(TeamAlias.objects.values_list('name', 'team_id'))
+        all_leagues = {league.name: league for league in League.objects.select_related('sport')}
+        # Сезоны по возрастанию начала: бинарный поиск вместо перебора на каждую строку
+        all_seasons = list(Season.objects.order_by('start_date', 'id'))
+        season_starts = [s.start_date for s in all_seasons]
+        # Максимальная дата окончания среди сезонов [0..i] — граница обратного прохода
+        season_max_ends = list(accumulate((s.end_date for s in all_seasons), max))
+        seasons_by_day = {}
+        existing_keys = set(Match.objects.values_list('date', 'home_team_id', 'away_team_id'))
+        tz = get_current_timezone()
+
+        def find_season(day):
+            """Как get_season_by_date: из подходящих сезонов берется самый поздний по началу."""
+            if day in seasons_by_day:
+                return seasons_by_day[day]
+            season = None
+            i = bisect_right(season_starts, day) - 1
+            while i >= 0 and season_max_ends[i] >= day:
+                if all_seasons[i].end_date >= day:
+                    season = all_seasons[i]
+                    break
+                i -= 1
+            seasons_by_day[day] = season
+            return season
+
+        def find_team_smart(team_name, all_aliases_dict, all_teams_by_name_dict):
+            nonlocal created_aliases, unknown_teams_list
+
+            if not team_name:
+                return None
+
+            clean_name = self.clean_team_name(team_name)
+
+            if clean_name in all_aliases_dict:
+                return all_aliases_dict[clean_name]
+
+            if clean_name in all_teams_by_name_dict:
+                team_id = all_teams_by_name_dict[clean_name]
+                alias, created = TeamAlias.objects.get_or_create(
+                    name=clean_name,
+                    defaults={'team_id': team_id}
+                )
+                if created:
+                    created_aliases += 1
+                    all_aliases_dict[clean_name] = team_id
+                return team_id
+
+            best_match = None
+            best_score = 0
+
+            for team_name_db, team_id in all_teams_by_name_dict.items():
+                if clean_name in team_name_db:
+                    score = len(clean_name) / len(team_name_db)
+                    if score > best_score:
+                        best_score = score
+                        best_match = team_id
+                elif team_name_db in clean_name:
+                    score = len(team_name_db) / len(clean_name)
+                    if score > best_score:
+                        best_score = score
+                        best_match = team_id
+
+            if best_match and best_score > 0.6:
+                alias, created = TeamAlias.objects.get_or_create(
+                    name=clean_name,
+                    defaults={'team_id': best_match}
+                )
+                if created:
+                    created_aliases += 1
+                    all_aliases_dict[clean_name] = best_match
+                return best_match
+
+            unknown_teams_list.append({
+                'name': team_name,
+                'clean_name': clean_name
+            })
+            return None
+
+        try:
+            # Весь файл читается и фильтруется колонками pandas,
+            # в цикл на Python попадают только строки, дошедшие до поиска команд
+            df = frame if frame is not None else self.load_csv_frame(source)
+            processed = len(df)
+
+            # Лига определяется один раз на каждый код Div, строки с неизвестным
+            # или пустым кодом отсекаются до любой другой обработки
+            div_codes = df['Div'].str.strip()
+            div_leagues = {}
+            for div_code in div_codes.unique():
+                if div_code:
+                    league = all_leagues.get(ParsingConstants.DIV_TO_LEAGUE_NAME.get(div_code))
+                    if league:
+                        div_leagues[div_code] = league
+            has_league = div_codes.isin(list(div_leagues))
+            leagues = div_codes[has_league].map(div_leagues)
+            skipped += int((~has_league).sum())
+            df = df[has_league]
+
+            date_strs = df['Date'].str.strip()
+            has_date = date_strs != ''
+            skipped += int((~has_date).sum())
+            df, leagues, date_strs = df[has_date], leagues[has_date], date_strs[has_date]
+
+            # Запасные форматы разбираются только для строк, не подошедших под основной
+            dates = pd.to_datetime(date_strs, format='%d/%m/%Y', errors='coerce', cache=True)
+            for date_format in ('%d/%m/%y', '%Y-%m-%d'):
+                missing = dates.isna()
+                if not missing.any():
+                    break
+                dates[missing] = pd.to_datetime(date_strs[missing], format=date_format, errors='coerce', cache=True)
+            has_dt = dates.notna()
+            errors += int((~has_dt).sum())
+            df, leagues, dates = df[has_dt], leagues[has_dt], dates[has_dt]
+
+            def first_filled(columns, default):
+                # Источники, пустые во всем файле (или отсутствующие), в цепочку не входят
+                columns = [column for column in columns if (df[column] != '').any()]
+                if not columns:
+                    return pd.Series(default, index=df.index)
+                values = df[columns[0]]
+                for column in columns[1:]:
+                    values = values.where(values != '', df[column])
+                return values.where(values != '', default)
+
+            def parse_column(values, parse):
+                # Коэффициенты и счета сильно повторяются: каждое значение разбирается один раз
+                parsed = {value: parse(value) for value in values.unique()}
+                return values.map(parsed)
+
+            odds_h = parse_column(first_filled(('AvgH', 'B365H', 'PSH'), '1.01'), self.parse_odd)
+            odds_d = parse_column(first_filled(('AvgD', 'B365D', 'PSD'), '1.01'), self.parse_odd)
+            odds_a = parse_column(first_filled(('AvgA', 'B365A', 'PSA'), '1.01'), self.parse_odd)
+            goals_h = parse_column(first_filled(('FTHG',), '0'), self.parse_score)
+            goals_a = parse_column(first_filled(('FTAG',), '0'), self.parse_score)
+
+            rows = zip(
+                leagues, dates, df['HomeTeam'].str.strip(), df['AwayTeam'].str.strip(),
+                odds_h, odds_d, odds_a, goals_h, goals_a,
+            )
+            for league, ts, home_team_name, away_team_name, odd_h, odd_d, odd_a, h_goal, a_goal in rows:
+                # Ошибка данных в строке пропускает только эту строку, а не откатывает весь файл;
+                # ошибки программы не перехватываются
+                try:
+                    dt = ts.to_pydatetime()
+                    season = find_season(dt.date())
+                    if not season:
+                        errors += 1
+                        continue
+
+                    if not home_team_name or not away_team_name:
+                        skipped += 1
+                        continue
+
+                    home_team_id = find_team_smart(home_team_name, all_aliases, all_teams_by_name)
+                    away_team_id = find_team_smart(away_team_name, all_aliases, all_teams_by_name)
+
+                    if not home_team_id or not away_team_id:
+                        skipped += 1
+                        continue
+
+                    # То же, что make_aware для zoneinfo, без обращения к get_current_timezone на строку
+                    dt_aware = dt.replace(tzinfo=tz)
+
+                    match_key = (dt_aware, home_team_id, away_team_id)
+                    if match_key in existing_keys:
+                        skipped += 1
+                        continue
+
+                    match = Match(
+                        season=season,
+                        league=league,
+                        date=dt_aware,
+                        home_team_id=home_team_id,
+                        away_team_id=away_team_id,
+                        home_score_reg=h_goal,
+                        away_score_reg=a_goal,
+                        home_score_final=h_goal,
+                        away_score_final=a_goal,
+                        odds_home=odd_h,
+                        odds_draw=odd_d,
+                        odds_away=odd_a,
+                        finish_type='REG'
+                    )
+                    # bulk_create не вызывает Match.save()/full_clean,
+                    # поэтому проверяем строку до постановки в очередь
+                    self.validate_bulk_match(match, team_sports)
+                except (ValueError, InvalidOperation, KeyError, ValidationError):
+                    errors += 1
+                    continue
+
+                to_create.append(match)
+                existing_keys.add(match_key)
+                count += 1
+
+                if len(to_create) >= ParsingConstants.CSV_BULK_BATCH_SIZE:
+                    failed = self.flush_matches(to_create)
+                    count -= failed
+                    errors += failed
+                    to_create.clear()
+
+            if to_create:
+                failed = self.flush_matches(to_create)
+                count -= failed
+                errors += failed
+
+        except pd.errors.EmptyDataError:
+            pass
+        except Exception:
+            errors += 1
+
+        return {
+            'added': count,
+            'skipped': skipped,
+            'errors': errors,
+            'created_aliases': created_aliases,
+            'unknown_teams_list': unknown_teams_list,
+            'unknown_teams': len(unknown_teams_list)
+        }
+
+    @staticmethod
+    def flush_matches(matches) -> int:
+        """
+        Записывает пачку матчей через bulk_create. Если пачка не записалась,
+        матчи пишутся по одному, каждый в своей точке сохранения: отбрасываются
+        только сбойные строки. Возвращает число незаписанных матчей.
+        """
+        try:
+            with transaction.atomic():
+                Match.objects.bulk_create(
+                    matches, batch_size=ParsingConstants.CSV_BULK_BATCH_SIZE, ignore_conflicts=True
+                )
+            return 0
+        except Exception:
+            failed = 0
+            for match in matches:
+                try:
+                    with transaction.atomic():
+                        Match.objects.bulk_create([match], ignore_conflicts=True)
+                except Exception:
+                    failed += 1
+            return failed
+
+    @classmethod
+    def load_csv_frame(cls, source):
+        """DataFrame импорта из пути или бинарного file-like объекта."""
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, mode='rb') as f:
+                return cls.read_csv_frame(f)
+        return cls.read_csv_frame(source)
+
+    @classmethod
+    def iter_csv_frames(cls, entries):
+        """
+        Пары (entry, frame) в исходном порядке. Файлы читаются pandas в пуле
+        потоков (разбор CSV отпускает GIL), а запись в БД остается
+        последовательной в вызывающем потоке — SQLite не допускает
+        параллельных писателей. frame=None, если файл прочитать не удалось:
+        process_csv_file перечитает его сам и учтет ошибку как раньше.
+        """
+        def load(entry):
+            try:
+                return cls.load_csv_frame(entry.path)
+            except Exception:
+                return None
+
+        with ThreadPoolExecutor(max_workers=ParsingConstants.CSV_READ_WORKERS) as executor:
+            yield from zip(entries, executor.map(load, entries))
+
+    @staticmethod
+    def read_csv_frame(f):
+        """
+        Читает CSV из бинарного потока в DataFrame строк с колонками импорта.
+        Разбор целиком завершается до записи в БД, поэтому при ошибке
+        декодирования поток просто перечитывается в latin-1.
+        """
+        first_line = f.readline()
+        delimiter = ';' if b';' in first_line else ','
+
+        def read(encoding):
+            f.seek(0)
+            # Явная обертка: pandas не всегда распознает UploadedFile как бинарный поток
+            text = io.TextIOWrapper(f, encoding=encoding, newline='')
+            try:
+                return pd.read_csv(
+                    text, sep=delimiter, dtype=str, keep_default_na=False, index_col=False,
+                    on_bad_lines='skip', usecols=lambda col: col in ParsingConstants.CSV_IMPORT_COLUMNS,
+                )
+            finally:
+                text.detach()
+
+        try:
+            df = read('utf-8-sig')
+        except UnicodeDecodeError:
+            df = read('latin-1')
+        return df.reindex(columns=list(ParsingConstants.CSV_IMPORT_COLUMNS)).fillna('')
+
+    @staticmethod
+    def validate_bulk_match(match, team_sports):
+        """
+        Проверка матча перед bulk_create (замена full_clean из Match.save).
+        Сезон уже подобран по дате, а счета основного и итогового времени
+        совпадают по построению, поэтому проверяются только поля и виды спорта.
+        """
+        match.clean_fields(exclude=['season', 'league', 'home_team', 'away_team'])
+
+        if match.home_team_id == match.away_team_id:
+            raise ValidationError("Команда не может играть сама с собой.")
+
+        sport = match.league.sport
+        if team_sports.get(match.home_team_id) != sport.id or team_sports.get(match.away_team_id) != sport.id:
+            raise ValidationError("Команды должны принадлежать тому же виду спорта, что и лига.")
+        if not sport.has_draw:
+            if match.odds_draw is not None:
+                raise ValidationError(f"В виде спорта '{sport}' рынок ничьих отсутствует.")
+            if match.home_score_reg is not None and match.home_score_reg == match.away_score_reg:
+                raise ValidationError(f"В виде спорта '{sport}' не может быть ничейного счета.")
+
+    @staticmethod
+    def get_team_by_alias(name):
+        if not name:
+            return None
+        clean_alias = normalize_alias(str(name))
+        alias = TeamAlias.objects.filter(name=clean_alias).select_related('team').first()
+        return alias.team if alias else None
+
+    @staticmethod
+    def get_season_by_date(dt):
+        return Season.objects.filter(start_date__lte=dt.date(), end_date__gte=dt.date()).first()
+
+    @staticmethod
+    def parse_score(val):
+        if not val:
+            return 0
+        s = val if type(val) is str else str(val)
+        if not s.strip() or s.lower() == 'nan':
+            return 0
+        if ',' in s:
+            s = s.replace(',', '.')
+        try:
+            return int(float(s))
+        except (ValueError, OverflowError):
+            return 0
+
+    @staticmethod
+    def parse_odd(val):
+        if not val:
+            return ODD_DEFAULT
+        s = val if type(val) is str else str(val)
+        if not s.strip() or s.lower() == 'nan':
+            return ODD_DEFAULT
+        if ',' in s:
+            s = s.replace(',', '.')
+        try:
+            return Decimal(s).quantize(ODDS_QUANT)
+        except InvalidOperation:
+            return ODD_DEFAULT
+
+    @staticmethod
+    def clean_team_name(name: str) -> str:
+        if not name:
+            return ""
+        name = name if type(name) is str else str(name)
+        if len(name) > TEAM_NAME_CACHE_MAX_LENGTH:
+            return _clean_import_team_name.__wrapped__(name)
+        return _clean_import_team_name(name)
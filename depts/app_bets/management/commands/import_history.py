@@ -7,6 +7,7 @@ from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 from app_bets.models import Match, Team, League, Season, Sport, Country, TeamAlias
+from app_bets.importing import csv_cell, csv_columns, csv_rows
 
 
 class Command(BaseCommand):
@@ -157,12 +158,13 @@ class Command(BaseCommand):
         seasons_cache = {}
 
         with open(file_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f, delimiter=delimiter, fieldnames=headers)
+            reader = csv.reader(f, delimiter=delimiter)
             next(reader)  # Пропускаем заголовки
+            columns = csv_columns(headers)
 
             batch_matches = []
 
-            for i, row in enumerate(reader, 1):
+            for i, row in enumerate(csv_rows(reader), 1):
                 if limit > 0 and stats['processed'] >= limit:
                     self.stdout.write(f"⏱  Достигнут лимит {limit} строк")
                     break
@@ -177,7 +179,7 @@ class Command(BaseCommand):
                 try:
                     # Обработка строки
                     match_data = self.process_row(
-                        row, div_mapping, sport, i,
+                        row, columns, div_mapping, sport, i,
                         leagues_cache, countries_cache, seasons_cache
                     )
 
@@ -222,16 +224,16 @@ class Command(BaseCommand):
 
         return stats
 
-    def process_row(self, row, div_mapping, sport, line_num,
+    def process_row(self, row, columns, div_mapping, sport, line_num,
                     leagues_cache, countries_cache, seasons_cache):
         """Обрабатывает одну строку."""
         try:
             # Извлекаем данные
-            div_code = row.get('Div', '').strip()
-            home_team_raw = row.get('HomeTeam', '').strip()
-            away_team_raw = row.get('AwayTeam', '').strip()
-            date_str = row.get('Date', '').strip()
-            time_str = row.get('Time', '').strip() or '15:00'
+            div_code = csv_cell(row, columns, 'Div', '').strip()
+            home_team_raw = csv_cell(row, columns, 'HomeTeam', '').strip()
+            away_team_raw = csv_cell(row, columns, 'AwayTeam', '').strip()
+            date_str = csv_cell(row, columns, 'Date', '').strip()
+            time_str = csv_cell(row, columns, 'Time', '').strip() or '15:00'
 
             # Проверка обязательных полей
             if not div_code or not home_team_raw or not away_team_raw or not date_str:
@@ -301,8 +303,8 @@ class Command(BaseCommand):
             )
 
             # Парсим счет
-            home_score = self.parse_score(row.get('FTHG'))
-            away_score = self.parse_score(row.get('FTAG'))
+            home_score = self.parse_score(csv_cell(row, columns, 'FTHG'))
+            away_score = self.parse_score(csv_cell(row, columns, 'FTAG'))
 
             # Проверяем на дубликат
             duplicate = self.check_duplicate(
@@ -317,12 +319,12 @@ class Command(BaseCommand):
                 }
 
             # Парсим коэффициенты с округлением
-            odds_home = self.parse_and_round_odds(row.get('B365H'), '2.00')
-            odds_draw = self.parse_and_round_odds(row.get('B365D'), '3.50') if sport.has_draw else None
-            odds_away = self.parse_and_round_odds(row.get('B365A'), '2.00')
+            odds_home = self.parse_and_round_odds(csv_cell(row, columns, 'B365H'), '2.00')
+            odds_draw = self.parse_and_round_odds(csv_cell(row, columns, 'B365D'), '3.50') if sport.has_draw else None
+            odds_away = self.parse_and_round_odds(csv_cell(row, columns, 'B365A'), '2.00')
 
             # Парсим дополнительные данные
-            round_number = self.parse_round(row.get('Round'))
+            round_number = self.parse_round(csv_cell(row, columns, 'Round'))
 
             # Создаем объект матча (но не сохраняем сразу)
             match = Match(
@@ -6,6 +6,7 @@ from django.db import transaction
 from django.utils.timezone import make_aware, get_current_timezone
 from app_bets.models import Match, TeamAlias, Season, League
 from app_bets.constants import ParsingConstants
+from app_bets.importing import csv_cell, csv_columns, csv_rows
 
 
 class Command(BaseCommand):
@@ -52,12 +53,13 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.SUCCESS(f"Запуск импорта матчей из {file_path}..."))
         with open(file_path, mode='r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f, delimiter=',')
+            reader = csv.reader(f, delimiter=',')
+            columns = csv_columns(next(reader, []))
 
-            for row in reader:
+            for row in csv_rows(reader):
                 try:
                     # 1. Поиск лиги по названию
-                    div_code = row.get('Div')
+                    div_code = csv_cell(row, columns, 'Div')
                     league_name = ParsingConstants.DIV_TO_LEAGUE_NAME.get(div_code)
 
                     if not league_name:
@@ -70,7 +72,7 @@ class Command(BaseCommand):
                         continue
 
                     # 2. Дата и Сезон
-                    date_str = row['Date'].strip()
+                    date_str = csv_cell(row, columns, 'Date').strip()
                     try:
                         dt = datetime.strptime(date_str, '%d/%m/%Y')
                     except ValueError:
@@ -81,8 +83,8 @@ class Command(BaseCommand):
                         continue
 
                     # 3. Поиск команд
-                    home_team = self.get_team_by_alias(row['HomeTeam'])
-                    away_team = self.get_team_by_alias(row['AwayTeam'])
+                    home_team = self.get_team_by_alias(csv_cell(row, columns, 'HomeTeam'))
+                    away_team = self.get_team_by_alias(csv_cell(row, columns, 'AwayTeam'))
 
                     if not home_team or not away_team:
                         skipped_teams += 1
@@ -94,13 +96,19 @@ class Command(BaseCommand):
                         continue
 
                     # 4. Сбор коэффициентов (Приоритет: Avg -> B365 -> PS)
-                    odd_h = self.parse_odd(row.get('AvgH') or row.get('B365H') or row.get('PSH'))
-                    odd_d = self.parse_odd(row.get('AvgD') or row.get('B365D') or row.get('PSD'))
-                    odd_a = self.parse_odd(row.get('AvgA') or row.get('B365A') or row.get('PSA'))
+                    odd_h = self.parse_odd(
+                        csv_cell(row, columns, 'AvgH') or csv_cell(row, columns, 'B365H') or csv_cell(row, columns, 'PSH')
+                    )
+                    odd_d = self.parse_odd(
+                        csv_cell(row, columns, 'AvgD') or csv_cell(row, columns, 'B365D') or csv_cell(row, columns, 'PSD')
+                    )
+                    odd_a = self.parse_odd(
+                        csv_cell(row, columns, 'AvgA') or csv_cell(row, columns, 'B365A') or csv_cell(row, columns, 'PSA')
+                    )
 
                     # 5. Сбор голов
-                    h_goal = self.parse_score(row['FTHG'])
-                    a_goal = self.parse_score(row['FTAG'])
+                    h_goal = self.parse_score(csv_cell(row, columns, 'FTHG'))
+                    a_goal = self.parse_score(csv_cell(row, columns, 'FTAG'))
 
                     # 6. Сохранение в БД
                     Match.objects.create(
@@ -127,7 +135,7 @@ class Command(BaseCommand):
                     errors += 1
                     # Выводим предупреждение, но продолжаем цикл
                     self.stdout.write(
-                        self.style.WARNING(f"Пропуск строки ({row.get('Date')} {row.get('HomeTeam')}): {e}"))
+                        self.style.WARNING(f"Пропуск строки ({csv_cell(row, columns, 'Date')} {csv_cell(row, columns, 'HomeTeam')}): {e}"))
 
         self.stdout.write(self.style.SUCCESS(f"\nФИНАЛЬНЫЙ ОТЧЕТ:"))
         self.stdout.write(f"- Добавлено новых матчей: {count}")
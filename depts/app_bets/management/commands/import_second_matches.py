@@ -10,6 +10,7 @@ from django.utils.timezone import make_aware, get_current_timezone
 
 from app_bets.models import Match, TeamAlias, Season, League, Country, Sport
 from app_bets.constants import ParsingConstants
+from app_bets.importing import MatchCSVImporter, csv_cell, csv_columns, csv_rows, normalize_alias
 
 
 class Command(BaseCommand):
@@ -38,7 +39,7 @@ class Command(BaseCommand):
         """Поиск команды по псевдониму"""
         if not name or str(name).strip() == "":
             return None
-        clean_alias = " ".join(name.split()).lower()
+        clean_alias = normalize_alias(name)
         alias = TeamAlias.objects.filter(name=clean_alias).select_related('team').first()
         return alias.team if alias else None
 
@@ -218,13 +219,16 @@ class Command(BaseCommand):
                     sample = f.read(1024)
                     f.seek(0)
                     # Если дошли сюда - кодировка подходит
-                    reader = csv.DictReader(f, delimiter=',')
+                    reader = csv.reader(f, delimiter=',')
+                    columns = csv_columns(next(reader, []))
                     self.stdout.write(f"   ✅ Используется кодировка: {encoding}")
 
                     # Обрабатываем строки
-                    for row_num, row in enumerate(reader, start=1):
+                    for row_num, row in enumerate(csv_rows(reader), start=1):
                         try:
-                            self.process_row(row, stats, create_leagues, dry_run, div_code, league_name, country_name)
+                            self.process_row(
+                                row, columns, stats, create_leagues, dry_run, div_code, league_name, country_name
+                            )
 
                             if stats['processed_matches'] % 100 == 0 and stats['processed_matches'] > 0:
                                 self.stdout.write(f"  ✅ Обработано матчей: {stats['processed_matches']}")
@@ -244,16 +248,21 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f"   ❌ Ошибка при чтении файла: {e}"))
                 break
 
-    def process_row(self, row, stats, create_leagues, dry_run, div_code, league_name, country_name):
+    def process_row(self, row, columns, stats, create_leagues, dry_run, div_code, league_name, country_name):
         """Обрабатывает одну строку CSV"""
 
-        # 1. Получаем или создаем лигу
-        league, is_new = self.get_or_create_league(
-            div_code,
-            league_name,
-            country_name,
-            create_if_missing=create_leagues
-        )
+        # 1. Получаем или создаем лигу (одна на папку, поэтому запоминается)
+        league_key = (div_code, league_name, country_name)
+        if league_key in self.leagues_cache:
+            league, is_new = self.leagues_cache[league_key], False
+        else:
+            league, is_new = self.get_or_create_league(
+                div_code,
+                league_name,
+                country_name,
+                create_if_missing=create_leagues
+            )
+            self.leagues_cache[league_key] = league
 
         if not league:
             stats['skipped_league'] += 1
@@ -266,8 +275,8 @@ class Command(BaseCommand):
             ))
 
         # 2. Дата и время
-        date_str = row.get('Date', '').strip()
-        time_str = row.get('Time', '12:00').strip()
+        date_str = csv_cell(row, columns, 'Date', '').strip()
+        time_str = csv_cell(row, columns, 'Time', '12:00').strip()
 
         try:
             dt = datetime.strptime(f"{date_str} {time_str}", '%d/%m/%Y %H:%M')
@@ -279,7 +288,7 @@ class Command(BaseCommand):
                 dt = datetime.strptime(date_str, '%d/%m/%Y')
 
         # 3. Сезон
-        season = self.get_season_by_date(dt)
+        season = self.find_season(dt.date())
         if not season:
             # Если сезон не найден, пропускаем
             self.stdout.write(self.style.WARNING(
@@ -288,11 +297,11 @@ class Command(BaseCommand):
             return
 
         # 4. Команды
-        home_team_name = row.get('HomeTeam', '').strip()
-        away_team_name = row.get('AwayTeam', '').strip()
+        home_team_name = csv_cell(row, columns, 'HomeTeam', '').strip()
+        away_team_name = csv_cell(row, columns, 'AwayTeam', '').strip()
 
-        home_team = self.get_team_by_alias(home_team_name)
-        away_team = self.get_team_by_alias(away_team_name)
+        home_team = self.find_team(home_team_name)
+        away_team = self.find_team(away_team_name)
 
         # Если команды не найдены, пытаемся создать
         if (not home_team or not away_team) and create_leagues:
@@ -303,6 +312,7 @@ class Command(BaseCommand):
                     league.country
                 )
                 if home_team:
+                    self.aliases[normalize_alias(home_team_name)] = home_team
                     stats['new_teams'] += 1
                     self.stdout.write(f"   ✨ Создана команда: {home_team_name}")
             if not away_team:
@@ -312,6 +322,7 @@ class Command(BaseCommand):
                     league.country
                 )
                 if away_team:
+                    self.aliases[normalize_alias(away_team_name)] = away_team
                     stats['new_teams'] += 1
                     self.stdout.write(f"   ✨ Создана команда: {away_team_name}")
 
@@ -319,45 +330,86 @@ class Command(BaseCommand):
             stats['skipped_teams'] += 1
             return
 
-        # 5. Проверка на дубликат
+        # 5. Проверка на дубликат (по ключам, загруженным один раз в handle)
         dt_aware = make_aware(dt, get_current_timezone())
-        if Match.objects.filter(
-                date=dt_aware,
-                home_team=home_team,
-                away_team=away_team
-        ).exists():
+        match_key = (dt_aware, home_team.id, away_team.id)
+        if match_key in self.existing_keys:
             stats['duplicates'] += 1
             return
 
         # 6. Сбор коэффициентов
-        odd_h = self.parse_odd(row.get('AvgH') or row.get('B365H') or row.get('PSH'))
-        odd_d = self.parse_odd(row.get('AvgD') or row.get('B365D') or row.get('PSD'))
-        odd_a = self.parse_odd(row.get('AvgA') or row.get('B365A') or row.get('PSA'))
+        odd_h = self.parse_odd(
+            csv_cell(row, columns, 'AvgH') or csv_cell(row, columns, 'B365H') or csv_cell(row, columns, 'PSH')
+        )
+        odd_d = self.parse_odd(
+            csv_cell(row, columns, 'AvgD') or csv_cell(row, columns, 'B365D') or csv_cell(row, columns, 'PSD')
+        )
+        odd_a = self.parse_odd(
+            csv_cell(row, columns, 'AvgA') or csv_cell(row, columns, 'B365A') or csv_cell(row, columns, 'PSA')
+        )
 
         # 7. Счет
-        h_goal = self.parse_score(row.get('FTHG', 0))
-        a_goal = self.parse_score(row.get('FTAG', 0))
+        h_goal = self.parse_score(csv_cell(row, columns, 'FTHG', 0))
+        a_goal = self.parse_score(csv_cell(row, columns, 'FTAG', 0))
+
+        # 8. Сохранение: матч копится в пачку для bulk_create
+        match = Match(
+            season=season,
+            league=league,
+            date=dt_aware,
+            home_team=home_team,
+            away_team=away_team,
+            home_score_reg=h_goal,
+            away_score_reg=a_goal,
+            home_score_final=h_goal,
+            away_score_final=a_goal,
+            odds_home=odd_h,
+            odds_draw=odd_d,
+            odds_away=odd_a,
+            finish_type='REG'
+        )
+        # bulk_create не вызывает full_clean, проверяем строку заранее
+        MatchCSVImporter.validate_bulk_match(
+            match, {home_team.id: home_team.sport_id, away_team.id: away_team.sport_id}
+        )
+        self.existing_keys.add(match_key)
 
-        # 8. Сохранение
         if not dry_run:
-            Match.objects.create(
-                season=season,
-                league=league,
-                date=dt_aware,
-                home_team=home_team,
-                away_team=away_team,
-                home_score_reg=h_goal,
-                away_score_reg=a_goal,
-                home_score_final=h_goal,
-                away_score_final=a_goal,
-                odds_home=odd_h,
-                odds_draw=odd_d,
-                odds_away=odd_a,
-                finish_type='REG'
-            )
+            self.pending_matches.append(match)
+            if len(self.pending_matches) >= ParsingConstants.CSV_BULK_BATCH_SIZE:
+                self.flush_matches()
 
         stats['processed_matches'] += 1
 
+    def find_team(self, name):
+        """Поиск команды по псевдониму в словаре, загруженном в handle"""
+        if not name:
+            return None
+        return self.aliases.get(normalize_alias(name))
+
+    def find_season(self, day):
+        """
+        Сезон по дате матча из списка, загруженного в handle. Как и get_season_by_date
+        (.first() при Meta.ordering = ['-start_date']), из пересекающихся сезонов
+        берется самый поздний по началу — тот же выбор, что в MatchCSVImporter.process_csv_file.
+        """
+        if day not in self.seasons_by_day:
+            self.seasons_by_day[day] = next(
+                (season for season in self.seasons if season.start_date <= day <= season.end_date),
+                None
+            )
+        return self.seasons_by_day[day]
+
+    def flush_matches(self):
+        """Записывает накопленные матчи одним bulk_create"""
+        if self.pending_matches:
+            Match.objects.bulk_create(
+                self.pending_matches,
+                batch_size=ParsingConstants.CSV_BULK_BATCH_SIZE,
+                ignore_conflicts=True
+            )
+            self.pending_matches = []
+
     @transaction.atomic
     def handle(self, *args, **options):
         base_path = options['path']
@@ -379,6 +431,20 @@ class Command(BaseCommand):
             'duplicates': 0
         }
 
+        # Ключи уже загруженных матчей (дата, хозяева, гости) — один запрос
+        # вместо exists() на каждую строку; новые матчи пишутся пачками
+        self.existing_keys = set(Match.objects.values_list('date', 'home_team_id', 'away_team_id'))
+        self.pending_matches = []
+
+        # Справочники загружаются один раз: псевдонимы команд, сезоны и лиги
+        # по папкам, чтобы не делать запросы на каждую строку CSV
+        self.aliases = {
+            alias.name: alias.team for alias in TeamAlias.objects.select_related('team')
+        }
+        self.seasons = list(Season.objects.order_by('-start_date', '-id'))
+        self.seasons_by_day = {}
+        self.leagues_cache = {}
+
         # Рекурсивно обходим все папки
         for root, dirs, files in os.walk(base_path):
             for file in files:
@@ -395,6 +461,8 @@ class Command(BaseCommand):
                 # Обрабатываем файл
                 self.process_csv_file(file_path, folder_name, stats, create_leagues, dry_run)
 
+        self.flush_matches()
+
         # Итоговый отчет
         self.stdout.write(self.style.SUCCESS("\n" + "=" * 60))
         self.stdout.write(self.style.SUCCESS("📊 ИТОГИ ИМПОРТА"))
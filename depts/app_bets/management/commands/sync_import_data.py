@@ -0,0 +1,61 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_bets.importing import MatchCSVImporter
+
+
+class Command(BaseCommand):
+    help = 'Синхронизация матчей из CSV-файлов папки import_data (фоновая замена кнопки синхронизации)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            type=str,
+            default='import_data',
+            help='Путь к папке с CSV-файлами (по умолчанию: import_data)'
+        )
+
+    def handle(self, *args, **options):
+        import_data_dir = options['path']
+        if not os.path.isdir(import_data_dir):
+            raise CommandError(f'Папка {import_data_dir} не найдена.')
+
+        with os.scandir(import_data_dir) as entries:
+            csv_files = sorted(
+                (entry for entry in entries if entry.name.endswith('.csv') and entry.is_file()),
+                key=lambda entry: entry.name
+            )
+
+        if not csv_files:
+            self.stdout.write(self.style.WARNING(f'В папке {import_data_dir} не найдено CSV файлов.'))
+            return
+
+        # Та же логика импорта, что и во вьюхе, но вне HTTP-запроса (cron/systemd timer)
+        importer = MatchCSVImporter()
+        totals = {'added': 0, 'skipped': 0, 'errors': 0, 'created_aliases': 0}
+        unknown_teams = set()
+
+        for entry, frame in importer.iter_csv_frames(csv_files):
+            result = importer.process_csv_file(entry.path, frame)
+            for key in totals:
+                totals[key] += result.get(key, 0)
+            unknown_teams.update(item['name'] for item in result['unknown_teams_list'])
+
+            self.stdout.write(
+                f"{entry.name}: +{result['added']} "
+                f"(пропущено {result['skipped']}, "
+                f"ошибок {result['errors']}, "
+                f"алиасов {result.get('created_aliases', 0)})"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"\nСИНХРОНИЗАЦИЯ ЗАВЕРШЕНА:"))
+        self.stdout.write(f"- Обработано файлов: {len(csv_files)}")
+        self.stdout.write(f"- Добавлено матчей: {totals['added']}")
+        self.stdout.write(f"- Пропущено: {totals['skipped']}")
+        self.stdout.write(f"- Ошибок: {totals['errors']}")
+        self.stdout.write(f"- Создано алиасов: {totals['created_aliases']}")
+        if unknown_teams:
+            self.stdout.write(self.style.WARNING(f"- Неизвестных команд: {len(unknown_teams)}"))
+            for name in sorted(unknown_teams):
+                self.stdout.write(f"    {name}")
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-16 18:20
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Value, When
+
+
+def remove_duplicate_matches(apps, schema_editor):
+    """
+    Удаляет дубли матчей (одинаковые дата и команды) перед добавлением ограничения.
+
+    Миграция необратимо удаляет данные: из каждой группы дублей остается одна запись —
+    сначала с заполненным счетом основного времени, среди них с меньшим id.
+    Старые импорты (import_history, админка) могли сохранить один матч несколько раз.
+    """
+    Match = apps.get_model('app_bets', 'Match')
+    duplicates = (
+        Match.objects.values('date', 'home_team_id', 'away_team_id')
+        .annotate(copies=Count('id'))
+        .filter(copies__gt=1)
+        .order_by()
+    )
+    for group in duplicates:
+        copies = Match.objects.filter(
+            date=group['date'],
+            home_team_id=group['home_team_id'],
+            away_team_id=group['away_team_id'],
+        )
+        keep_id = copies.annotate(
+            no_score=Case(
+                When(home_score_reg__isnull=False, away_score_reg__isnull=False, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('no_score', 'id').values_list('id', flat=True).first()
+        copies.exclude(id=keep_id).delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bets', '0004_league_external_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_matches, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='match',
+            constraint=models.UniqueConstraint(fields=('date', 'home_team', 'away_team'), name='uniq_match_date_teams'),
+        ),
+    ]
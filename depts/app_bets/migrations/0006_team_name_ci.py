@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+def fill_name_ci(apps, schema_editor):
+    # Заполняет name_ci у существующих команд так же, как Team.save
+    Team = apps.get_model('app_bets', 'Team')
+    teams = list(Team.objects.only('id', 'name'))
+    for team in teams:
+        team.name_ci = team.name.lower()
+    Team.objects.bulk_update(teams, ['name_ci'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_bets', '0005_match_uniq_match_date_teams'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='name_ci',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100, verbose_name='Название в нижнем регистре'),
+        ),
+        migrations.RunPython(fill_name_ci, migrations.RunPython.noop),
+    ]
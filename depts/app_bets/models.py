@@ -2,7 +2,7 @@ import math
 from django.db import models
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
-from django.db.models import Q, Avg, Sum, F
+from django.db.models import Q, Avg, Sum, F, Count
 from decimal import Decimal
 from django.utils.timezone import is_naive, make_aware, get_current_timezone
 from app_bets.constants import AnalysisConstants
@@ -150,6 +150,9 @@ class League(models.Model):
 class Team(models.Model):
     """Каноническая запись команды или игрока (Мастер-запись)."""
     name = models.CharField(max_length=100, verbose_name="Каноническое название")
+    # Название в нижнем регистре для регистронезависимого поиска по индексу (заполняется в save)
+    name_ci = models.CharField(max_length=100, db_index=True, editable=False, default='',
+                               verbose_name="Название в нижнем регистре")
     sport = models.ForeignKey(Sport, on_delete=models.CASCADE)
     country = models.ForeignKey(Country, on_delete=models.CASCADE)
 
@@ -161,6 +164,13 @@ class Team(models.Model):
         verbose_name = "Команда / Игрок"
         verbose_name_plural = "Команды и Игроки"
 
+    def save(self, *args, **kwargs):
+        self.name_ci = self.name.lower() if self.name else ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'name_ci'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -289,6 +299,10 @@ class Match(models.Model):
             models.Index(fields=["league", "date"]),  # новый индекс
             models.Index(fields=["home_team", "away_team"]),  # новый индекс
         ]
+        constraints = [
+            # Защита от повторного импорта одного и того же матча (bulk_create(ignore_conflicts=True))
+            models.UniqueConstraint(fields=["date", "home_team", "away_team"], name="uniq_match_date_teams"),
+        ]
         verbose_name = "Матч"
         verbose_name_plural = "Матчи"
         ordering = ['-date']
@@ -705,12 +719,16 @@ class Match(models.Model):
             if top_score:
                 signals.append(f"Пуассон: {top_score} ({score_poisson[top_score]}%)")
 
-        # 2. Анализ Близнецов
-        if twins.exists():
-            t_count = twins.count()
-            h_wins = twins.filter(home_score_reg__gt=F('away_score_reg')).count()
-            draws = twins.filter(home_score_reg=F('away_score_reg')).count()
-            a_wins = twins.filter(home_score_reg__lt=F('away_score_reg')).count()
+        # 2. Анализ Близнецов (все счетчики одним агрегирующим запросом)
+        twins_stats = twins.aggregate(
+            t_count=Count('id'),
+            h_wins=Count('id', filter=Q(home_score_reg__gt=F('away_score_reg'))),
+            draws=Count('id', filter=Q(home_score_reg=F('away_score_reg'))),
+            a_wins=Count('id', filter=Q(home_score_reg__lt=F('away_score_reg'))),
+        )
+        t_count = twins_stats['t_count']
+        if t_count:
+            h_wins, draws, a_wins = twins_stats['h_wins'], twins_stats['draws'], twins_stats['a_wins']
 
             if (h_wins / t_count) > 0.6:
                 signals.append(f"Близнецы: П1 {round(h_wins / t_count * 100)}%")
@@ -885,9 +903,10 @@ class Match(models.Model):
 
             # --- 2. ЛИЧНЫЕ ВСТРЕЧИ (H2H) ---
             try:
-                h2h = self.get_h2h(limit=10)
-                if h2h and h2h.exists():
-                    count = h2h.count()
+                # Один запрос: список уже материализован, его длина и есть count()
+                h2h = list(self.get_h2h(limit=10))
+                if h2h:
+                    count = len(h2h)
                     if count >= 2:
                         over_25 = 0
                         total_goals = 0
@@ -910,9 +929,9 @@ class Match(models.Model):
 
             # --- 3. БЛИЗНЕЦЫ В КОНТЕКСТЕ ---
             try:
-                twins = self.get_twins(tolerance=Decimal('0.10'))
-                if twins and twins.exists():
-                    count = twins.count()
+                twins = list(self.get_twins(tolerance=Decimal('0.10')))
+                if twins:
+                    count = len(twins)
                     if count >= 3:
                         over_25 = 0
                         total_goals = 0
@@ -935,21 +954,24 @@ class Match(models.Model):
 
             # --- 4. ТРЕНДЫ ФОРМЫ ---
             try:
-                home_recent = Match.objects.filter(
+                home_recent = list(Match.objects.filter(
                     league_id=self.league_id,
                     home_team_id=self.home_team_id,
                     home_score_reg__isnull=False,
                     date__lt=self.date
-                ).order_by('-date')[:5] if self.date else Match.objects.none()
+                ).order_by('-date')[:5]) if self.date else []
 
-                away_recent = Match.objects.filter(
+                away_recent = list(Match.objects.filter(
                     league_id=self.league_id,
                     away_team_id=self.away_team_id,
                     away_score_reg__isnull=False,
                     date__lt=self.date
-                ).order_by('-date')[:5] if self.date else Match.objects.none()
+                ).order_by('-date')[:5]) if self.date else []
+
+                home_count = len(home_recent)
+                away_count = len(away_recent)
 
-                if home_recent.count() >= 3 and away_recent.count() >= 3:
+                if home_count >= 3 and away_count >= 3:
                     home_over = 0
                     home_total_goals = 0
                     for m in home_recent:
@@ -967,10 +989,10 @@ class Match(models.Model):
                             away_over += 1
 
                     result['trend'] = {
-                        'home_over_25': round(home_over / home_recent.count() * 100, 1),
-                        'home_avg_goals': round(home_total_goals / home_recent.count(), 2),
-                        'away_over_25': round(away_over / away_recent.count() * 100, 1),
-                        'away_avg_goals': round(away_total_goals / away_recent.count(), 2),
+                        'home_over_25': round(home_over / home_count * 100, 1),
+                        'home_avg_goals': round(home_total_goals / home_count, 2),
+                        'away_over_25': round(away_over / away_count * 100, 1),
+                        'away_avg_goals': round(away_total_goals / away_count, 2),
                         'method': 'Тренды формы (последние 5 матчей)'
                     }
             except Exception:
@@ -0,0 +1,19 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from app_bets.constants import CacheConstants
+from app_bets.models import Team, League, Country
+
+
+@receiver([post_save, post_delete], sender=Team)
+def invalidate_sorted_teams(sender, **kwargs):
+    """Сбрасывает кэш списка команд текущего процесса (другие воркеры — по ALL_TEAMS_TIMEOUT)."""
+    cache.delete(CacheConstants.ALL_TEAMS_KEY)
+
+
+@receiver([post_save, post_delete], sender=League)
+@receiver([post_save, post_delete], sender=Country)
+def invalidate_league_codes(sender, **kwargs):
+    """Сбрасывает кэш кодов лиг текущего процесса при изменении лиг или стран (страна входит в ключ)."""
+    cache.delete(CacheConstants.LEAGUE_CODES_KEY)
@@ -1,20 +1,30 @@
 import math
+import re
 import unittest
 from decimal import Decimal
 from datetime import datetime, date
 from unittest.mock import patch
-from django.test import TestCase, RequestFactory
+import pandas as pd
+from django.test import TestCase, RequestFactory, override_settings
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.utils.timezone import make_aware
 import os
+import pickle
 import tempfile
 import csv
-from .constants import AnalysisConstants, ParsingConstants, Messages
+from .constants import AnalysisConstants, Messages, CacheConstants
 
 from app_bets.models import (
     Team, TeamAlias, League, Season, Match, Country, Sport
 )
-from app_bets.views import AnalyzeView, UploadCSVView, CleanedTemplateView
+from app_bets.views import (
+    AnalyzeView, UploadCSVView, CleanedTemplateView, get_sorted_teams,
+    unpack_form, FORM_CODE_WIN, FORM_CODE_DRAW, FORM_CODE_LOSE, TWINS_TOLERANCES,
+    save_analysis, load_analysis, save_cleaned_analysis, load_cleaned_analysis, _clean_team_name_cached,
+    _load_calibration_frame
+)
 
 
 class TestPoissonMathematicalAccuracy(TestCase):
@@ -241,14 +251,14 @@ class TestCleanTeamName(TestCase):
 
     def setUp(self):
         self.view = AnalyzeView()
-        # Сохраняем оригинальный TIME_REGEX
-        self.original_time_regex = ParsingConstants.TIME_REGEX
-        # Устанавливаем исправленный regex для тестов
-        ParsingConstants.TIME_REGEX = r'\d{1,2}[:.]\d{2}(?:\s*МСК)?|\d{1,2}[:.]\d{2}\s*-\s*\d{1,2}[:.]\d{2}'
-
-    def tearDown(self):
-        # Восстанавливаем оригинальный regex
-        ParsingConstants.TIME_REGEX = self.original_time_regex
+        # Устанавливаем исправленный regex времени для тестов (очищенные названия
+        # кэшируются, поэтому кэш сбрасывается до и после подмены)
+        time_regex = re.compile(r'\d{1,2}[:.]\d{2}(?:\s*МСК)?|\d{1,2}[:.]\d{2}\s*-\s*\d{1,2}[:.]\d{2}')
+        patcher = patch('app_bets.views.TEAM_NAME_TIME_RE', time_regex)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        _clean_team_name_cached.cache_clear()
+        self.addCleanup(_clean_team_name_cached.cache_clear)
 
     def test_basic_cleaning(self):
         """Базовая очистка названия"""
@@ -405,6 +415,63 @@ class TestGetPoissonProbs(TestCase):
         self.assertAlmostEqual(total_over, 100, delta=0.1)
 
 
+class TestUnpackForm(TestCase):
+    """Тестирование упаковки формы команды"""
+
+    def test_unpack_keeps_order_and_window(self):
+        """Последние исходы остаются в младших битах, старые вытесняются маской"""
+        form_length = AnalysisConstants.PATTERN_FORM_LENGTH
+        mask = (1 << (2 * form_length)) - 1
+        bits = 0
+        for code in (FORM_CODE_LOSE, FORM_CODE_WIN, FORM_CODE_DRAW, FORM_CODE_WIN, FORM_CODE_LOSE):
+            bits = ((bits << 2) | code) & mask
+
+        self.assertEqual(unpack_form(bits, form_length), "ВНВП")
+        self.assertEqual(unpack_form(bits, 2), "ВП")
+        self.assertEqual(unpack_form(0, 0), "")
+
+
+class TestTallyTwins(TestCase):
+    """Тестирование подсчета исходов матчей-близнецов"""
+
+    def test_tally_by_tolerance(self):
+        """Учитываются только матчи, где оба кэфа в пределах допуска"""
+        # (id, league_id, season_id, home_team_id, away_team_id, hs, as, odds_home, odds_away)
+        league_matches = [
+            (1, 1, 1, 1, 2, 2, 0, Decimal('1.80'), Decimal('4.00')),
+            (2, 1, 1, 3, 4, 1, 1, Decimal('1.84'), Decimal('3.96')),
+            (3, 1, 1, 5, 6, 0, 1, Decimal('1.90'), Decimal('4.00')),
+            (4, 1, 1, 7, 8, 3, 1, Decimal('2.50'), Decimal('2.80')),
+        ]
+        league_odds = AnalyzeView.build_league_odds(league_matches)
+        tolerances = TWINS_TOLERANCES
+
+        self.assertEqual(
+            AnalyzeView.tally_twins(league_odds, Decimal('1.82'), Decimal('3.98'), tolerances),
+            [[1, 1, 0], [1, 1, 1]]
+        )
+        self.assertEqual(
+            AnalyzeView.tally_twins(league_odds, Decimal('1.93'), Decimal('4.03'), tolerances),
+            [[0, 0, 1], [0, 1, 1]]
+        )
+        self.assertEqual(
+            AnalyzeView.tally_twins(league_odds, Decimal('5.00'), Decimal('1.50'), tolerances),
+            [[0, 0, 0], [0, 0, 0]]
+        )
+
+
+class TestRoundPercentages(TestCase):
+    """Тестирование перевода исходов в проценты"""
+
+    def test_sum_is_always_100(self):
+        """Погрешность округления уходит в наибольшую долю"""
+        self.assertEqual(AnalyzeView.round_percentages(1, 1, 1), (34, 33, 33))
+        self.assertEqual(AnalyzeView.round_percentages(1, 2, 0), (33, 67, 0))
+        self.assertEqual(AnalyzeView.round_percentages(5, 0, 0), (100, 0, 0))
+        for counts in ((1, 1, 4), (2, 3, 6), (7, 5, 1), (0, 1, 2)):
+            self.assertEqual(sum(AnalyzeView.round_percentages(*counts)), 100)
+
+
 class TestGetTeamSmart(TestCase):
     """Тестирование интеллектуального поиска команд"""
 
@@ -679,7 +746,7 @@ class TestUploadCSVView(TestCase):
         season = self.view.get_season_by_date(dt)
         self.assertIsNone(season)
 
-    @patch('app_bets.views.ParsingConstants.DIV_TO_LEAGUE_NAME')
+    @patch('app_bets.importing.ParsingConstants.DIV_TO_LEAGUE_NAME')
     def test_process_csv_file(self, mock_div_to_league):
         """Тестирование обработки CSV файла"""
         mock_div_to_league.get.return_value = "La Liga"
@@ -702,7 +769,30 @@ class TestUploadCSVView(TestCase):
         if os.path.exists(f.name):
             os.unlink(f.name)
 
+    @patch('app_bets.importing.MatchCSVImporter.validate_bulk_match', side_effect=[ValidationError('сбой'), None])
+    @patch('app_bets.importing.ParsingConstants.DIV_TO_LEAGUE_NAME')
+    def test_process_csv_file_row_error_skips_only_row(self, mock_div_to_league, mock_validate):
+        """Ошибка валидации строки считается ошибкой строки, остальные строки импортируются"""
+        mock_div_to_league.get.return_value = "La Liga"
+
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Div', 'Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'AvgH', 'AvgD', 'AvgA'])
+            writer.writerow(['SP1', '15/09/2024', 'барселона', 'реал мадрид', '2', '1', '1.85', '3.50', '4.20'])
+            writer.writerow(['SP1', '22/09/2024', 'реал мадрид', 'барселона', '0', '0', '2.10', '3.40', '3.30'])
+        self.addCleanup(os.unlink, f.name)
 
+        result = self.view.process_csv_file(f.name)
+
+        self.assertEqual((result['added'], result['errors']), (1, 1))
+        self.assertEqual(Match.objects.get().home_team, self.team_real)
+
+
+# Результаты анализа кладём в память, чтобы тесты не писали в файловый кэш BASE_DIR/cache/analysis
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    CacheConstants.ANALYSIS_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
 class TestSessionAndCleanedResults(TestCase):
     """Тестирование работы с сессией и очищенными результатами"""
 
@@ -774,6 +864,89 @@ class TestSessionAndCleanedResults(TestCase):
         self.assertIn('cleaned_results', context)
         self.assertEqual(len(context['cleaned_results']), 1)
 
+    def test_analysis_results_kept_in_cache(self):
+        """Результаты хранятся в кэше под одним ключом сессии, в самой сессии их нет"""
+        request = self.add_session_to_request(self.factory.get('/'))
+        self.assertEqual(load_cleaned_analysis(request), [])
+
+        save_analysis(request, [{'match': 'Барселона - Реал Мадрид'}], 'текст')
+        save_cleaned_analysis(request, [{'match': 'Барселона - Реал Мадрид', 'ev': 5.0}])
+
+        self.assertEqual(load_analysis(request)['raw_text'], 'текст')
+        self.assertEqual(load_cleaned_analysis(request)[0]['ev'], 5.0)
+        self.assertEqual(list(request.session.keys()), ['analysis_key'])
+
+
+class TestCleanedFindTeams(TestCase):
+    """Тестирование поиска команд очищенного анализа по названию и алиасу"""
+
+    def setUp(self):
+        self.sport = Sport.objects.create(name="Футбол")
+        self.spain = Country.objects.create(name="Испания")
+        self.team = Team.objects.create(name="Барселона", country=self.spain, sport=self.sport)
+        TeamAlias.objects.create(team=self.team, name="Барса")
+
+    def test_case_insensitive_by_name_and_alias(self):
+        """Кириллица сравнивается без учета регистра, неизвестные названия пропускаются"""
+        self.assertEqual(self.team.name_ci, "барселона")
+
+        teams = CleanedTemplateView().find_teams({"БАРСЕЛОНА", "барса", "Неизвестная", float('nan')})
+
+        self.assertEqual(teams, {"БАРСЕЛОНА": self.team, "барса": self.team})
+
+    def test_every_spelling_and_lowest_id_wins(self):
+        """Разные написания одного названия находятся все; при конфликте имени и алиаса — меньший id"""
+        Team.objects.create(name="Барса", country=self.spain, sport=self.sport)
+
+        teams = CleanedTemplateView().find_teams({"Барселона", "БАРСЕЛОНА", "Барса"})
+
+        self.assertEqual(teams, {"Барселона": self.team, "БАРСЕЛОНА": self.team, "Барса": self.team})
+
+
+class TestCalibrationIndex(TestCase):
+    """Тестирование индекса калибровочных интервалов"""
+
+    def test_malformed_interval_skipped(self):
+        """Неразобранный интервал пропускается, остальные строки группы ищутся как обычно"""
+        frame = pd.DataFrame({
+            'league': ['EPL'] * 3,
+            'target': ['over'] * 3,
+            'last_matches': [5] * 3,
+            'interval': ['40-50', 'n/a', '>80'],
+            'actual_%': [47.0, 99.0, 83.0],
+        })
+        with tempfile.NamedTemporaryFile(suffix='.pkl', delete=False) as f:
+            pickle.dump(frame, f)
+        self.addCleanup(os.unlink, f.name)
+
+        calib_df = _load_calibration_frame(f.name, os.path.getmtime(f.name)).copy()
+        calib_df['external_id'] = 39
+        index = CleanedTemplateView.build_calibration_index(calib_df)
+        league = League(external_id=39)
+
+        view = CleanedTemplateView()
+        self.assertEqual(view.find_calibration(index, league, 'over', 5, 0.45), (47.0, '40-50'))
+        self.assertEqual(view.find_calibration(index, league, 'over', 5, 0.9), (83.0, '>80'))
+        self.assertEqual(view.find_calibration(index, league, 'over', 5, 0.6), (None, None))
+
+
+class TestSortedTeamsCache(TestCase):
+    """Тестирование кэша списка команд"""
+
+    def setUp(self):
+        cache.delete(CacheConstants.ALL_TEAMS_KEY)
+        self.sport = Sport.objects.create(name="Футбол")
+        self.spain = Country.objects.create(name="Испания")
+        Team.objects.create(name="севилья", country=self.spain, sport=self.sport)
+
+    def test_sorted_and_invalidated_on_save(self):
+        """Список отсортирован и сбрасывается при добавлении команды"""
+        self.assertEqual([t.name for t in get_sorted_teams()], ["севилья"])
+
+        Team.objects.create(name="барселона", country=self.spain, sport=self.sport)
+
+        self.assertEqual([t.name for t in get_sorted_teams()], ["барселона", "севилья"])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
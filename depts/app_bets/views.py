@@ -15,13 +15,18 @@
 - raw_text: оригинальный текст, введенный пользователем
 - all_teams: QuerySet всех команд для выпадающего списка
 """
-import csv
 import logging
 import os
 import pickle
+import uuid
+from collections import defaultdict, deque
 from datetime import datetime
 from decimal import Decimal
-from typing import List, Dict, Optional
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 import openpyxl
 import pandas as pd
 from django.conf import settings
@@ -29,7 +34,7 @@ from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.db import transaction
+from django.core.cache import cache, caches
 from django.db.models import F, Q, Sum, DecimalField
 from django.db.models.functions import Coalesce
 from django.http import HttpResponse
@@ -37,7 +42,6 @@ from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
 from django.utils import timezone
 from django.utils.decorators import method_decorator
-from django.utils.timezone import make_aware, get_current_timezone
 from django.views import View
 import re
 import math
@@ -45,138 +49,395 @@ import unicodedata
 from django.views.decorators.cache import cache_page
 from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView, CreateView, ListView
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.utils import get_column_letter
 
-from app_bets.constants import Outcome, ParsingConstants, AnalysisConstants, Messages
+from app_bets.constants import Outcome, ParsingConstants, AnalysisConstants, Messages, CacheConstants
 from app_bets.forms import BetForm
+from app_bets.importing import MatchCSVImporter, ODDS_QUANT, TEAM_NAME_CACHE_MAX_LENGTH
 from app_bets.models import Team, TeamAlias, Season, Match, League, Bet, Sport, Country, Bank
 
 # Настройка логгера для мониторинга
 logger = logging.getLogger(__name__)
 
+# Коды исходов для упаковки формы команды (2 бита на матч).
+# Код исхода хозяев совпадает с индексом счетчика П1/Х/П2.
+FORM_CODE_WIN = 0
+FORM_CODE_DRAW = 1
+FORM_CODE_LOSE = 2
+FORM_CODE_OUTCOMES = (Outcome.WIN, Outcome.DRAW, Outcome.LOSE)
+
+# Допуски поиска близнецов (малый, расширенный) во float: сравнение идет
+# с float-кэфами истории, Decimal нужен только при записи в БД
+TWINS_TOLERANCES = (
+    float(AnalysisConstants.TWINS_TOLERANCE_SMALL),
+    float(AnalysisConstants.TWINS_TOLERANCE_LARGE),
+)
+
+# Сетка счетов для распределения Пуассона (0..POISSON_MAX_GOALS голов у каждой команды)
+POISSON_GOALS = np.arange(AnalysisConstants.POISSON_MAX_GOALS + 1)
+POISSON_FACTORIALS = np.cumprod(np.maximum(POISSON_GOALS, 1)).astype(float)
+POISSON_OVER25_MASK = np.add.outer(POISSON_GOALS, POISSON_GOALS) > AnalysisConstants.TOTAL_THRESHOLD
+POISSON_SCORE_LABELS = [f"{h}:{a}" for h in POISSON_GOALS.tolist() for a in POISSON_GOALS.tolist()]
+
+# Скомпилированные выражения для классификации строк вставленного текста
+ODDS_LINE_RE = re.compile(ParsingConstants.ODDS_REGEX)
+TIME_LINE_RE = re.compile(ParsingConstants.TIME_REGEX)
+DIGITS_ONLY_RE = re.compile(ParsingConstants.DIGITS_ONLY_REGEX)
+# Одна альтернация вместо проверки вхождения каждого ключевого слова по очереди
+LEAGUE_KEYWORDS_RE = re.compile('|'.join(map(re.escape, sorted(ParsingConstants.LEAGUE_KEYWORDS))))
+
+# Выражения очистки названий команд
+TEAM_NAME_TIME_RE = TIME_LINE_RE
+TEAM_NAME_JUNK_RE = re.compile(r'[^\w\s\d\-\']')
+TEAM_NAME_EDGE_DIGITS_RE = re.compile(r'^\d+\s+|\s+\d+$')
+TEAM_NAME_DASHES_RE = re.compile(r'[\-\–\—]+')
+
+
+# Ключи сортировки результатов анализа: считаются один раз при анализе
+# и хранятся в самих результатах, сортировка идет по itemgetter
+RESULT_SORT_KEYS = {
+    'btts_desc': '_k_btts',
+    'over25_desc': '_k_over25',
+    'twins_p1_desc': '_k_twins',
+    'pattern_p1_desc': '_k_pattern',
+}
+
+
+def unpack_form(bits: int, length: int) -> str:
+    """Распаковывает форму команды в строку исходов (от старых матчей к новым)."""
+    return "".join(
+        FORM_CODE_OUTCOMES[(bits >> (2 * i)) & 0b11]
+        for i in range(length - 1, -1, -1)
+    )
+
+
+def get_sorted_teams() -> List['Team']:
+    """
+    Список команд для выпадающего списка привязки алиасов. Кэшируется в памяти процесса
+    на ALL_TEAMS_TIMEOUT; сигнал сбрасывает кэш сразу только в процессе, изменившем команду.
+    """
+    return cache.get_or_set(
+        CacheConstants.ALL_TEAMS_KEY,
+        lambda: list(Team.objects.order_by('name').only('id', 'name')),
+        CacheConstants.ALL_TEAMS_TIMEOUT
+    )
+
+
+def _analysis_cache_key(request, template: str) -> str:
+    """Ключ кэша результатов текущей сессии; сам идентификатор хранится в сессии."""
+    key = request.session.get('analysis_key')
+    if not key:
+        key = uuid.uuid4().hex
+        request.session['analysis_key'] = key
+    return template.format(key)
+
+
+def save_analysis(request, results: List[Dict], raw_text: str) -> None:
+    """
+    Сохраняет результаты анализа в общий для воркеров кэш (CACHES['analysis'])
+    под ключом, записанным в сессию. В самой сессии остается только ключ.
+    """
+    caches[CacheConstants.ANALYSIS_CACHE_ALIAS].set(
+        _analysis_cache_key(request, CacheConstants.ANALYSIS_RESULTS_KEY),
+        {'results': results, 'raw_text': raw_text},
+        CacheConstants.ANALYSIS_RESULTS_TIMEOUT
+    )
+    # Старые сессии хранили результаты прямо в себе
+    for stale_key in ('results', 'raw_text', 'original_results'):
+        request.session.pop(stale_key, None)
+
+
+def load_analysis(request) -> Dict:
+    """Результаты последнего анализа из кэша (пустые, если ключа нет или запись истекла)."""
+    key = request.session.get('analysis_key')
+    if not key:
+        return {'results': [], 'raw_text': ''}
+    payload = caches[CacheConstants.ANALYSIS_CACHE_ALIAS].get(CacheConstants.ANALYSIS_RESULTS_KEY.format(key))
+    return payload or {'results': [], 'raw_text': ''}
+
+
+def save_cleaned_analysis(request, results: List[Dict]) -> None:
+    """Результаты очищенного анализа (ТБ/ТМ 2.5) — в общий кэш рядом с результатами анализа текста."""
+    caches[CacheConstants.ANALYSIS_CACHE_ALIAS].set(
+        _analysis_cache_key(request, CacheConstants.CLEANED_RESULTS_KEY),
+        results,
+        CacheConstants.ANALYSIS_RESULTS_TIMEOUT
+    )
+    request.session.pop('cleaned_analysis_results', None)
+
+
+def load_cleaned_analysis(request) -> List[Dict]:
+    """Результаты очищенного анализа из кэша (пустой список, если их нет)."""
+    key = request.session.get('analysis_key')
+    if not key:
+        return []
+    return caches[CacheConstants.ANALYSIS_CACHE_ALIAS].get(CacheConstants.CLEANED_RESULTS_KEY.format(key)) or []
+
+
+@lru_cache(maxsize=4)
+def _load_calibration_frame(path: str, mtime: float) -> pd.DataFrame:
+    """
+    Калибровочная таблица из pickle; mtime в ключе сбрасывает кэш при замене файла.
+    Границы интервалов ('>80' -> 80..100, '40-50' -> 40..50) разбираются здесь один раз
+    на версию файла в числовые колонки iv_low/iv_high.
+    """
+    with open(path, 'rb') as f:
+        df = pickle.load(f)
+    intervals = df['interval'].astype(str)
+    above = intervals.str.startswith('>')
+    parts = intervals.str.lstrip('>').str.partition('-')
+    # Некорректные интервалы дают NaN и отбрасываются в build_calibration_index,
+    # а не ломают загрузку всего файла
+    df['iv_low'] = pd.to_numeric(parts[0], errors='coerce')
+    df['iv_high'] = pd.to_numeric(parts[2].where(~above, '100'), errors='coerce')
+    return df
+
+
+@lru_cache(maxsize=4)
+def _load_excel_frame(path: str, mtime: float) -> pd.DataFrame:
+    """Excel-файл с матчами; mtime в ключе сбрасывает кэш при замене файла."""
+    return pd.read_excel(path)
+
+
+@lru_cache(maxsize=4096)
+def _clean_team_name_cached(name: str) -> str:
+    """
+    Нормализация названия команды. Одни и те же названия встречаются в тексте
+    многократно, поэтому результат кэшируется по исходной строке.
+    """
+    try:
+        # ASCII не меняется при NFKC-нормализации
+        if not name.isascii():
+            name = unicodedata.normalize('NFKC', name)
+        name = TEAM_NAME_TIME_RE.sub('', name)
+        name = TEAM_NAME_JUNK_RE.sub(' ', name)
+        name = TEAM_NAME_EDGE_DIGITS_RE.sub('', name)
+        name = TEAM_NAME_DASHES_RE.sub(' ', name)
+        name = ' '.join(name.split())
+        return name.strip().lower()
+    except Exception as e:
+        logger.warning(f"Ошибка очистки названия команды '{name}': {e}")
+        return str(name).strip().lower() if name else ""
+
+
+@lru_cache(maxsize=2048)
+def _poisson_probs_cached(l_home: float, l_away: float) -> tuple:
+    """
+    Распределение Пуассона для пары лямбд (уже ограниченных снизу).
+    Лямбды приходят округленными до сотых, поэтому пары в пределах лиги
+    часто повторяются — результат кэшируется.
+
+    Возвращает (((счет, вероятность), ...), btts_yes, btts_no, over25_yes, over25_no).
+    """
+    # Вероятности голов векторами, сетка счетов — внешнее произведение (в %)
+    home_pmf = math.exp(-l_home) * np.power(l_home, POISSON_GOALS) / POISSON_FACTORIALS
+    away_pmf = math.exp(-l_away) * np.power(l_away, POISSON_GOALS) / POISSON_FACTORIALS
+    grid = np.outer(home_pmf, away_pmf) * 100
+
+    # Лучшие счета: по убыванию округленной вероятности, при равенстве —
+    # счет, встретившийся раньше при обходе (h, a) по строкам
+    flat = grid.ravel()
+    candidates = np.flatnonzero(flat > AnalysisConstants.MIN_PROBABILITY)
+    rounded = np.round(flat[candidates], 2)
+    top = candidates[np.lexsort((candidates, -rounded))[:5]]
+    top_scores = tuple(
+        (POISSON_SCORE_LABELS[idx], round(float(flat[idx]), 2))
+        for idx in top.tolist()
+    )
+
+    btts_yes = float(grid[1:, 1:].sum())
+    btts_no = float(grid.sum()) - btts_yes
+    over25_yes = float(grid[POISSON_OVER25_MASK].sum())
+    over25_no = float(grid[~POISSON_OVER25_MASK].sum())
+
+    total_btss = btts_yes + btts_no
+    total_over = over25_yes + over25_no
+
+    if total_btss > 0:
+        btts_yes = (btts_yes / total_btss) * 100
+        btts_no = (btts_no / total_btss) * 100
+
+    if total_over > 0:
+        over25_yes = (over25_yes / total_over) * 100
+        over25_no = (over25_no / total_over) * 100
+
+    return top_scores, round(btts_yes, 2), round(btts_no, 2), round(over25_yes, 2), round(over25_no, 2)
+
 
 class AnalyzeView(View):
     template_name = 'app_bets/bets_main.html'
 
     def get(self, request):
-        results = request.session.get('results', [])
-        raw_text = request.session.get('raw_text', '')
+        analysis = load_analysis(request)
+        results = analysis['results']
+        raw_text = analysis['raw_text']
         unknown_teams = request.session.get('unknown_teams', [])
-        original_results = request.session.get('original_results', [])
 
         current_sort = request.GET.get('sort') or request.session.get('current_sort', 'default')
         request.session['current_sort'] = current_sort
 
         if results:
-            if current_sort == 'default':
-                if original_results:
-                    results[:] = [dict(r) for r in original_results]
-            elif current_sort == 'btts_desc':
-                results.sort(key=lambda x: x['poisson_btts']['yes'], reverse=True)
-            elif current_sort == 'over25_desc':
-                results.sort(key=lambda x: x['poisson_over25']['yes'], reverse=True)
-            elif current_sort == 'twins_p1_desc':
-                results.sort(
-                    key=lambda x: max(
-                        x.get('twins_data', {}).get('p1', 0) if x.get('twins_data') else 0,
-                        x.get('twins_data', {}).get('p2', 0) if x.get('twins_data') else 0
-                    ),
-                    reverse=True
-                )
-            elif current_sort == 'pattern_p1_desc':
-                results.sort(
-                    key=lambda x: max(
-                        x.get('pattern_data', {}).get('p1', 0) if x.get('pattern_data') else 0,
-                        x.get('pattern_data', {}).get('p2', 0) if x.get('pattern_data') else 0
-                    ),
-                    reverse=True
-                )
-
-        all_teams = Team.objects.all().order_by('name')
+            self.sort_results(results, current_sort)
 
         return render(request, self.template_name, {
             'results': results,
             'raw_text': raw_text,
             'unknown_teams': sorted(unknown_teams),
-            'all_teams': all_teams,
+            'all_teams': get_sorted_teams(),
             'current_sort': current_sort,
         })
 
+    @staticmethod
+    def add_sort_keys(result: Dict) -> Dict:
+        """Добавляет в результат анализа готовые ключи сортировки (см. RESULT_SORT_KEYS)."""
+        twins, pattern = result.get('twins_data'), result.get('pattern_data')
+        result['_k_btts'] = result['poisson_btts']['yes']
+        result['_k_over25'] = result['poisson_over25']['yes']
+        result['_k_twins'] = max(twins.get('p1', 0), twins.get('p2', 0)) if twins else 0
+        result['_k_pattern'] = max(pattern.get('p1', 0), pattern.get('p2', 0)) if pattern else 0
+        return result
+
+    @classmethod
+    def sort_results(cls, results: List[Dict], current_sort: str) -> None:
+        """
+        Сортирует результаты на месте по убыванию выбранного показателя,
+        'default' — в исходном порядке разбора текста (ключ _ord).
+        """
+        if current_sort == 'default':
+            if all('_ord' in result for result in results):
+                results.sort(key=itemgetter('_ord'))
+            return
+
+        sort_key = RESULT_SORT_KEYS.get(current_sort)
+        if not sort_key:
+            return
+        # Результаты из старых сессий могут быть без ключей
+        for result in results:
+            if sort_key not in result:
+                cls.add_sort_keys(result)
+        # Равные значения остаются в исходном порядке, независимо от прошлых сортировок
+        if all('_ord' in result for result in results):
+            results.sort(key=itemgetter('_ord'))
+        results.sort(key=itemgetter(sort_key), reverse=True)
+
     @staticmethod
     def clean_team_name(name: str) -> str:
         if not name:
             return ""
-        try:
-            name = unicodedata.normalize('NFKC', str(name))
-            name = re.sub(ParsingConstants.TIME_REGEX, '', name)
-            name = re.sub(r'[^\w\s\d\-\']', ' ', name)
-            name = re.sub(r'^\d+\s+|\s+\d+$', '', name)
-            name = re.sub(r'[\-\–\—]+', ' ', name)
-            name = ' '.join(name.split())
-            return name.strip().lower()
-        except Exception as e:
-            logger.warning(f"Ошибка очистки названия команды '{name}': {e}")
-            return str(name).strip().lower() if name else ""
+        name = name if type(name) is str else str(name)
+        # Длинные строки (вставленный мусор) не кэшируются, чтобы не вытеснять названия
+        if len(name) > TEAM_NAME_CACHE_MAX_LENGTH:
+            return _clean_team_name_cached.__wrapped__(name)
+        return _clean_team_name_cached(name)
 
     @staticmethod
-    def get_poisson_probs(l_home: float, l_away: float) -> Dict:
-        probs = []
-        btts_yes = 0.0
-        btts_no = 0.0
-        over25_yes = 0.0
-        over25_no = 0.0
-
-        try:
-            l_home = max(float(l_home), AnalysisConstants.POISSON_MIN_LAMBDA)
-            l_away = max(float(l_away), AnalysisConstants.POISSON_MIN_LAMBDA)
-
-            exp_home = math.exp(-l_home)
-            exp_away = math.exp(-l_away)
+    def build_league_forms(league_matches, season):
+        """
+        Формы команд и статистика паттернов по истории лиги.
+
+        Возвращает (form_bits, form_len, pattern_stats):
+        - form_bits/form_len — упакованная форма (2 бита на исход, последние
+          PATTERN_FORM_LENGTH матчей) и число матчей команды в текущем сезоне;
+        - pattern_stats — исходы [П1, Х, П2] по всей истории лиги для каждого
+          паттерна (форма хозяев, форма гостей) перед матчем.
+        league_matches должны быть упорядочены по дате.
+        """
+        form_length = AnalysisConstants.PATTERN_FORM_LENGTH
+        form_mask = (1 << (2 * form_length)) - 1
 
-            max_goals = AnalysisConstants.POISSON_MAX_GOALS
-            factorials = [math.factorial(i) for i in range(max_goals + 1)]
-            home_powers = [l_home ** i for i in range(max_goals + 1)]
-            away_powers = [l_away ** i for i in range(max_goals + 1)]
+        form_bits = defaultdict(int)
+        form_len = defaultdict(int)
 
-            for h in range(max_goals + 1):
-                p_h = (exp_home * home_powers[h]) / factorials[h]
-                for a in range(max_goals + 1):
-                    p_a = (exp_away * away_powers[a]) / factorials[a]
-                    probability = p_h * p_a * 100
+        for _, _, s_id, h_id, a_id, hs, as_, _, _ in league_matches:
+            if s_id != season.id:
+                continue
 
-                    if probability > AnalysisConstants.MIN_PROBABILITY:
-                        probs.append({
-                            'score': f"{h}:{a}",
-                            'prob': round(probability, 2)
-                        })
+            # Определение результата для каждой команды
+            if hs == as_:
+                code_h, code_a = FORM_CODE_DRAW, FORM_CODE_DRAW
+            elif hs > as_:
+                code_h, code_a = FORM_CODE_WIN, FORM_CODE_LOSE
+            else:
+                code_h, code_a = FORM_CODE_LOSE, FORM_CODE_WIN
+
+            form_bits[h_id] = ((form_bits[h_id] << 2) | code_h) & form_mask
+            form_bits[a_id] = ((form_bits[a_id] << 2) | code_a) & form_mask
+            form_len[h_id] += 1
+            form_len[a_id] += 1
+
+        # За один проход по всей истории лиги считаем исходы для каждого паттерна
+        history_bits = defaultdict(int)
+        history_len = defaultdict(int)
+        pattern_stats = {}
+
+        for _, _, _, h_id, a_id, hs, as_, _, _ in league_matches:
+            if hs == as_:
+                code_h, code_a = FORM_CODE_DRAW, FORM_CODE_DRAW
+            elif hs > as_:
+                code_h, code_a = FORM_CODE_WIN, FORM_CODE_LOSE
+            else:
+                code_h, code_a = FORM_CODE_LOSE, FORM_CODE_WIN
 
-                    if h > 0 and a > 0:
-                        btts_yes += probability
-                    else:
-                        btts_no += probability
+            # Учитываем матч только при полной форме обеих команд
+            if history_len[h_id] >= form_length and history_len[a_id] >= form_length:
+                key = (history_bits[h_id] << (2 * form_length)) | history_bits[a_id]
+                stats = pattern_stats.get(key)
+                if stats is None:
+                    stats = pattern_stats[key] = [0, 0, 0]
+                # Индексы счетчиков: 0 - П1, 1 - ничья, 2 - П2
+                stats[code_h] += 1
 
-                    if (h + a) > 2.5:
-                        over25_yes += probability
-                    else:
-                        over25_no += probability
+            history_bits[h_id] = ((history_bits[h_id] << 2) | code_h) & form_mask
+            history_bits[a_id] = ((history_bits[a_id] << 2) | code_a) & form_mask
+            history_len[h_id] += 1
+            history_len[a_id] += 1
 
-            top_scores = sorted(probs, key=lambda x: x['prob'], reverse=True)[:5]
+        return form_bits, form_len, pattern_stats
 
-            total_btss = btts_yes + btts_no
-            total_over = over25_yes + over25_no
+    @staticmethod
+    def build_league_odds(league_matches) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Колонки истории лиги для поиска близнецов: кэфы П1, П2 (float64)
+        и исход матча (индекс П1/Х/П2). Считается один раз на лигу.
+        """
+        odds = np.array([(m[7], m[8]) for m in league_matches], dtype=float).reshape(-1, 2)
+        scores = np.array([(m[5], m[6]) for m in league_matches], dtype=np.int64).reshape(-1, 2)
+        # П1 -> 0, Х -> 1, П2 -> 2
+        outcome = np.sign(scores[:, 1] - scores[:, 0]) + 1
+        return odds[:, 0], odds[:, 1], outcome
 
-            if total_btss > 0:
-                btts_yes = (btts_yes / total_btss) * 100
-                btts_no = (btts_no / total_btss) * 100
+    @staticmethod
+    def tally_twins(league_odds, h_odd, a_odd, tolerances) -> List[List[int]]:
+        """
+        Исходы матчей-близнецов [П1, Х, П2] для каждого допуска из tolerances
+        (см. build_league_odds): матчи, у которых кэфы П1 и П2 отличаются
+        не больше чем на допуск. Считается масками NumPy по всей лиге сразу.
+        """
+        odds_home, odds_away, outcome = league_odds
+        diff = np.maximum(np.abs(odds_home - float(h_odd)), np.abs(odds_away - float(a_odd)))
+        return [np.bincount(outcome[diff <= tol], minlength=3).tolist() for tol in tolerances]
 
-            if total_over > 0:
-                over25_yes = (over25_yes / total_over) * 100
-                over25_no = (over25_no / total_over) * 100
+    @staticmethod
+    def round_percentages(hw: int, dw: int, aw: int) -> Tuple[int, int, int]:
+        """
+        Доли исходов П1/Х/П2 в целых процентах с коррекцией до 100%:
+        погрешность округления добавляется к наибольшей доле (при равенстве — к первой).
+        """
+        total = hw + dw + aw
+        pcts = [round(hw / total * 100), round(dw / total * 100), round(aw / total * 100)]
+        diff = 100 - sum(pcts)
+        if diff:
+            pcts[pcts.index(max(pcts))] += diff
+        return pcts[0], pcts[1], pcts[2]
 
-            btts_yes = round(btts_yes, 2)
-            btts_no = round(btts_no, 2)
-            over25_yes = round(over25_yes, 2)
-            over25_no = round(over25_no, 2)
+    @staticmethod
+    def get_poisson_probs(l_home: float, l_away: float) -> Dict:
+        try:
+            l_home = max(float(l_home), AnalysisConstants.POISSON_MIN_LAMBDA)
+            l_away = max(float(l_away), AnalysisConstants.POISSON_MIN_LAMBDA)
+            top_scores, btts_yes, btts_no, over25_yes, over25_no = _poisson_probs_cached(l_home, l_away)
 
         except Exception as e:
             logger.error(f"Ошибка расчета вероятностей Пуассона: {e}")
@@ -189,7 +450,8 @@ class AnalyzeView(View):
             }
 
         return {
-            'top_scores': top_scores,
+            # Новые словари на каждый вызов: результат кэша не должен изменяться снаружи
+            'top_scores': [{'score': score, 'prob': prob} for score, prob in top_scores],
             'btts_yes': btts_yes,
             'btts_no': btts_no,
             'over25_yes': over25_yes,
@@ -201,16 +463,34 @@ class AnalyzeView(View):
         if not clean_name:
             return None
 
-        team = Team.objects.filter(name__iexact=clean_name).first()
+        team = Team.objects.select_related('country').filter(name__iexact=clean_name).first()
         if team:
             return team
 
-        alias = TeamAlias.objects.filter(name__iexact=clean_name).select_related('team').first()
+        alias = TeamAlias.objects.filter(name__iexact=clean_name).select_related('team__country').first()
         if alias:
             return alias.team
 
         return None
 
+    def _is_team_name_candidate(self, row: str) -> bool:
+        """Строка текста может быть названием команды (не время, не лига, не служебное слово)."""
+        if not row or row == '-':
+            return False
+        if TIME_LINE_RE.match(row):
+            return False
+        row_lower = row.lower()
+        if row_lower in ParsingConstants.SKIP_KEYWORDS:
+            return False
+        if LEAGUE_KEYWORDS_RE.search(row_lower):
+            return False
+
+        clean_name = self.clean_team_name(row)
+        return bool(clean_name and
+                    len(clean_name) >= AnalysisConstants.MIN_TEAM_NAME_LENGTH and
+                    not DIGITS_ONLY_RE.match(clean_name) and
+                    clean_name not in ParsingConstants.BLACKLIST)
+
     def _extract_team_names(self, lines: List[str], odds_index: int) -> List[str]:
         names = []
         search_depth = min(ParsingConstants.MAX_SEARCH_DEPTH, odds_index)
@@ -220,24 +500,7 @@ class AnalyzeView(View):
                 break
 
             row = lines[j].strip()
-
-            if not row:
-                continue
-            if row == '-':
-                continue
-            if re.match(ParsingConstants.TIME_REGEX, row):
-                continue
-            if row.lower() in ParsingConstants.SKIP_KEYWORDS:
-                continue
-            if any(keyword in row.lower() for keyword in ParsingConstants.LEAGUE_KEYWORDS):
-                continue
-
-            clean_name = self.clean_team_name(row)
-            if (clean_name and
-                    len(clean_name) >= AnalysisConstants.MIN_TEAM_NAME_LENGTH and
-                    not re.match(ParsingConstants.DIGITS_ONLY_REGEX, clean_name) and
-                    clean_name not in ParsingConstants.BLACKLIST):
-
+            if self._is_team_name_candidate(row):
                 names.append(row)
                 if len(names) == 2:
                     break
@@ -263,431 +526,374 @@ class AnalyzeView(View):
             if alias_raw and t_id:
                 try:
                     clean_n = self.clean_team_name(alias_raw)
-                    with transaction.atomic():
-                        TeamAlias.objects.update_or_create(
-                            name=clean_n,
-                            defaults={'team_id': t_id}
-                        )
+                    # update_or_create сам выполняется в транзакции
+                    TeamAlias.objects.update_or_create(
+                        name=clean_n,
+                        defaults={'team_id': t_id}
+                    )
                 except Exception as e:
                     logger.error(f"Ошибка сохранения алиаса: {e}")
 
         # --- ИНИЦИАЛИЗАЦИЯ ---
         results = []
         unknown_teams = set()
-        season = Season.objects.filter(is_current=True).first() or Season.objects.order_by('-start_date').first()
+        # Текущий сезон, а при его отсутствии — последний по дате начала (один запрос)
+        season = Season.objects.order_by('-is_current', '-start_date').first()
 
         lines = [l.strip() for l in raw_text.split('\n') if l.strip()]
 
         if not lines:
-            request.session['results'] = results
-            request.session['raw_text'] = raw_text
+            save_analysis(request, results, raw_text)
             request.session['unknown_teams'] = list(unknown_teams)
             request.session['current_sort'] = current_sort
-            request.session['original_results'] = []
             return render(request, self.template_name, {
                 'results': results,
                 'raw_text': raw_text,
                 'unknown_teams': sorted(list(unknown_teams)),
-                'all_teams': Team.objects.all().order_by('name'),
+                'all_teams': get_sorted_teams(),
                 'current_sort': current_sort,
             })
 
-        # --- ЗАГРУЗКА ДАННЫХ ДЛЯ ОПТИМИЗАЦИИ ---
-        all_matches = list(Match.objects.filter(
-            home_score_reg__isnull=False
-        ).select_related(
-            'home_team', 'away_team', 'league', 'season'
-        ).order_by('date'))
-
-        # Индексация матчей по лиге для быстрого доступа
-        matches_by_league = {}
-        for match in all_matches:
-            if match.league_id not in matches_by_league:
-                matches_by_league[match.league_id] = []
-            matches_by_league[match.league_id].append(match)
-
-        # Кэширование команд, алиасов и лиг
-        all_teams = {team.id: team for team in Team.objects.all()}
-        all_aliases = {}
-        for alias in TeamAlias.objects.all().select_related('team'):
-            all_aliases[alias.name] = alias.team
-        all_leagues = {league.id: league for league in League.objects.all()}
-
-        # --- ПАРСИНГ И АНАЛИЗ МАТЧЕЙ ---
+        # --- ПАРСИНГ ТЕКСТА ---
+        # Сначала разбираем весь текст, чтобы затем найти все команды разом
+        # Один проход вперед: кандидаты в названия копятся в окне последних
+        # MAX_SEARCH_DEPTH строк, вместо обратного поиска от каждой тройки кэфов
+        parsed_matches = []
+        recent_names = deque(maxlen=ParsingConstants.MAX_SEARCH_DEPTH)
         skip_to = -1
         for i, line in enumerate(lines):
             if i <= skip_to:
                 continue
 
-            if re.match(ParsingConstants.ODDS_REGEX, line):
-                try:
-                    # Парсинг коэффициентов
-                    h_odd = Decimal(line.replace(',', '.')).quantize(Decimal(Messages.DECIMAL_FORMAT))
-                    d_odd = Decimal(lines[i + 1].replace(',', '.')).quantize(Decimal(Messages.DECIMAL_FORMAT))
-                    a_odd = Decimal(lines[i + 2].replace(',', '.')).quantize(Decimal(Messages.DECIMAL_FORMAT))
-                    skip_to = i + 2
-
-                    # Извлечение названий команд
-                    names = self._extract_team_names(lines, i)
-
-                    if len(names) == 2:
-                        away_raw, home_raw = names[0], names[1]
-
-                        # Поиск команд
-                        home_team = None
-                        away_team = None
-
-                        clean_home = self.clean_team_name(home_raw)
-                        clean_away = self.clean_team_name(away_raw)
-
-                        # Поиск по алиасам
-                        if clean_home in all_aliases:
-                            home_team = all_aliases[clean_home]
-                        else:
-                            # Поиск по точному совпадению имени
-                            for team in all_teams.values():
-                                if team.name.lower() == clean_home:
-                                    home_team = team
-                                    break
-
-                        if clean_away in all_aliases:
-                            away_team = all_aliases[clean_away]
-                        else:
-                            for team in all_teams.values():
-                                if team.name.lower() == clean_away:
-                                    away_team = team
-                                    break
-
-                        if home_team and away_team:
-                            # --- ОПРЕДЕЛЕНИЕ ЛИГИ (по текущему сезону) ---
-                            league = None
-
-                            # 1. Сначала ищем матчи между этими командами в ТЕКУЩЕМ сезоне
-                            current_season_matches = [m for m in all_matches if m.season_id == season.id]
-                            for match in current_season_matches:
-                                if ((match.home_team_id == home_team.id and match.away_team_id == away_team.id) or
-                                    (
-                                            match.home_team_id == away_team.id and match.away_team_id == home_team.id)) and match.league:
-                                    league = match.league
-                                    logger.info(f"Лига найдена по личным встречам в текущем сезоне: {league.name}")
-                                    break
-
-                            # 2. Если не нашли, ищем матчи home_team в текущем сезоне
-                            if not league:
-                                for match in current_season_matches:
-                                    if match.home_team_id == home_team.id and match.league:
-                                        league = match.league
-                                        logger.info(
-                                            f"Лига найдена по домашним матчам {home_team.name} в текущем сезоне: {league.name}")
-                                        break
-
-                            # 3. Если не нашли, ищем матчи away_team в текущем сезоне
-                            if not league:
-                                for match in current_season_matches:
-                                    if match.away_team_id == away_team.id and match.league:
-                                        league = match.league
-                                        logger.info(
-                                            f"Лига найдена по гостевым матчам {away_team.name} в текущем сезоне: {league.name}")
-                                        break
-
-                            # 4. Если все еще не нашли, ищем в истории (любой сезон)
-                            if not league:
-                                for match in all_matches:
-                                    if ((match.home_team_id == home_team.id and match.away_team_id == away_team.id) or
-                                        (
-                                                match.home_team_id == away_team.id and match.away_team_id == home_team.id)) and match.league:
-                                        league = match.league
-                                        logger.info(f"Лига найдена по личным встречам в истории: {league.name}")
-                                        break
-
-                            # 5. Если не нашли, ищем по домашним матчам home_team в истории
-                            if not league:
-                                for match in all_matches:
-                                    if match.home_team_id == home_team.id and match.league:
-                                        league = match.league
-                                        logger.info(
-                                            f"Лига найдена по домашним матчам {home_team.name} в истории: {league.name}")
-                                        break
-
-                            # 6. Если не нашли, ищем по гостевым матчам away_team в истории
-                            if not league:
-                                for match in all_matches:
-                                    if match.away_team_id == away_team.id and match.league:
-                                        league = match.league
-                                        logger.info(
-                                            f"Лига найдена по гостевым матчам {away_team.name} в истории: {league.name}")
-                                        break
-
-                            # 7. Если ничего не нашли, пробуем по стране
-                            if not league:
-                                league = League.objects.filter(country=home_team.country).first()
-                                if league:
-                                    logger.info(f"Лига найдена по стране {home_team.country}: {league.name}")
-
-                            if not league:
-                                unknown_teams.add(home_raw.strip())
-                                unknown_teams.add(away_raw.strip())
-                                continue
-
-                            league_matches = matches_by_league.get(league.id, [])
-
-                            # --- ИСТОРИЧЕСКИЙ ПАТТЕРН (только текущий сезон) ---
-                            # Формируем историю команд только из матчей текущего сезона
-                            current_season_matches = [m for m in league_matches if m.season_id == season.id]
-                            sorted_current_season_matches = sorted(current_season_matches, key=lambda x: x.date)
-
-                            team_history_current = {}
-
-                            for m in sorted_current_season_matches:
-                                h_id, a_id = m.home_team_id, m.away_team_id
-
-                                # Определение результата для каждой команды
-                                if m.home_score_reg == m.away_score_reg:
-                                    res_h = Outcome.DRAW  # Н
-                                    res_a = Outcome.DRAW  # Н
-                                elif m.home_score_reg > m.away_score_reg:
-                                    res_h = Outcome.WIN  # В
-                                    res_a = Outcome.LOSE  # П
-                                else:
-                                    res_h = Outcome.LOSE  # П
-                                    res_a = Outcome.WIN  # В
-
-                                team_history_current.setdefault(h_id, []).append(res_h)
-                                team_history_current.setdefault(a_id, []).append(res_a)
-
-                            # Получение последних 4 матчей для каждой команды
-                            curr_h_form = "".join(team_history_current.get(home_team.id, []))[
-                                          -AnalysisConstants.PATTERN_FORM_LENGTH:]
-                            curr_a_form = "".join(team_history_current.get(away_team.id, []))[
-                                          -AnalysisConstants.PATTERN_FORM_LENGTH:]
-
-                            # --- ПОИСК СОВПАДЕНИЙ ПАТТЕРНОВ (вся история лиги) ---
-                            # Строим историю команд за все время для поиска паттернов
-                            all_league_matches_sorted = sorted(league_matches, key=lambda x: x.date)
-                            team_history_all = {}
-                            match_patterns_all = {}
-
-                            for m in all_league_matches_sorted:
-                                h_id, a_id = m.home_team_id, m.away_team_id
-
-                                # Получаем текущие формы для этого момента в истории
-                                h_f = "".join(team_history_all.get(h_id, []))[-AnalysisConstants.PATTERN_FORM_LENGTH:]
-                                a_f = "".join(team_history_all.get(a_id, []))[-AnalysisConstants.PATTERN_FORM_LENGTH:]
-
-                                # Сохраняем паттерн для этого матча
-                                if len(h_f) == AnalysisConstants.PATTERN_FORM_LENGTH and len(
-                                        a_f) == AnalysisConstants.PATTERN_FORM_LENGTH:
-                                    match_patterns_all[m.id] = (h_f, a_f)
-
-                                # Добавляем результат в историю
-                                if m.home_score_reg == m.away_score_reg:
-                                    res_h = Outcome.DRAW
-                                    res_a = Outcome.DRAW
-                                elif m.home_score_reg > m.away_score_reg:
-                                    res_h = Outcome.WIN
-                                    res_a = Outcome.LOSE
-                                else:
-                                    res_h = Outcome.LOSE
-                                    res_a = Outcome.WIN
-
-                                team_history_all.setdefault(h_id, []).append(res_h)
-                                team_history_all.setdefault(a_id, []).append(res_a)
-
-                            pattern_data = None
-                            p_hw, p_dw, p_aw, p_count = 0, 0, 0, 0
-
-                            # Поиск матчей с таким же паттерном
-                            if len(curr_h_form) == AnalysisConstants.PATTERN_FORM_LENGTH and len(
-                                    curr_a_form) == AnalysisConstants.PATTERN_FORM_LENGTH:
-                                for m in league_matches:
-                                    if match_patterns_all.get(m.id) == (curr_h_form, curr_a_form):
-                                        p_count += 1
-                                        if m.home_score_reg > m.away_score_reg:
-                                            p_hw += 1
-                                        elif m.home_score_reg == m.away_score_reg:
-                                            p_dw += 1
-                                        else:
-                                            p_aw += 1
-
-                                if p_count > 0:
-                                    # Расчет процентов с коррекцией до 100%
-                                    p1_pct = round(p_hw / p_count * 100)
-                                    x_pct = round(p_dw / p_count * 100)
-                                    p2_pct = round(p_aw / p_count * 100)
-
-                                    total_pct = p1_pct + x_pct + p2_pct
-                                    if total_pct != 100:
-                                        diff = 100 - total_pct
-                                        max_val = max(p1_pct, x_pct, p2_pct)
-                                        if p1_pct == max_val:
-                                            p1_pct += diff
-                                        elif x_pct == max_val:
-                                            x_pct += diff
-                                        else:
-                                            p2_pct += diff
-
-                                    pattern_data = {
-                                        'pattern': f"{curr_h_form} - {curr_a_form}",
-                                        'count': p_count,
-                                        'p1': p1_pct,
-                                        'x': x_pct,
-                                        'p2': p2_pct
-                                    }
-
-                            # --- ЛИЧНЫЕ ВСТРЕЧИ (только где home_team - хозяин, away_team - гость) ---
-                            h2h_queryset = Match.objects.filter(
-                                home_team=home_team,
-                                away_team=away_team
-                            ).select_related(
-                                'home_team', 'away_team'
-                            ).order_by('-date')[:10]
-
-                            h2h_list = []
-                            for m in h2h_queryset:
-                                h2h_list.append({
-                                    'date': m.date.strftime(Messages.DATE_FORMAT),
-                                    'score': f"{m.home_score_reg}:{m.away_score_reg}"
-                                })
-
-                            # --- ПУАССОН ---
-                            m_obj = Match(
-                                home_team=home_team,
-                                away_team=away_team,
-                                league=league,
-                                season=season,
-                                odds_home=h_odd
-                            )
-                            p_data = m_obj.calculate_poisson_lambda_last_n(AnalysisConstants.LAMBDA_LAST_N)
-                            poisson_results = self.get_poisson_probs(p_data['home_lambda'], p_data['away_lambda'])
-                            top_scores = poisson_results['top_scores']
-                            historical_total_insight = m_obj.get_historical_total_insight()
-
-                            # --- БЛИЗНЕЦЫ ---
-                            tol = AnalysisConstants.TWINS_TOLERANCE_SMALL
-                            twins_matches = []
-
-                            for m in league_matches:
-                                h_diff = abs(float(m.odds_home) - float(h_odd))
-                                a_diff = abs(float(m.odds_away) - float(a_odd))
-                                if h_diff <= tol and a_diff <= tol:
-                                    twins_matches.append(m)
-
-                            if not twins_matches:
-                                tol = AnalysisConstants.TWINS_TOLERANCE_LARGE
-                                for m in league_matches:
-                                    h_diff = abs(float(m.odds_home) - float(h_odd))
-                                    a_diff = abs(float(m.odds_away) - float(a_odd))
-                                    if h_diff <= tol and a_diff <= tol:
-                                        twins_matches.append(m)
-
-                            t_count = len(twins_matches)
-                            twins_data = None
-
-                            if t_count > 0:
-                                hw_t = sum(1 for m in twins_matches if m.home_score_reg > m.away_score_reg)
-                                dw_t = sum(1 for m in twins_matches if m.home_score_reg == m.away_score_reg)
-                                aw_t = sum(1 for m in twins_matches if m.home_score_reg < m.away_score_reg)
-
-                                total_with_results = hw_t + dw_t + aw_t
-
-                                if total_with_results > 0:
-                                    p1_pct = round(hw_t / total_with_results * 100)
-                                    x_pct = round(dw_t / total_with_results * 100)
-                                    p2_pct = round(aw_t / total_with_results * 100)
-
-                                    total_pct = p1_pct + x_pct + p2_pct
-                                    if total_pct != 100:
-                                        diff = 100 - total_pct
-                                        max_val = max(p1_pct, x_pct, p2_pct)
-                                        if p1_pct == max_val:
-                                            p1_pct += diff
-                                        elif x_pct == max_val:
-                                            x_pct += diff
-                                        else:
-                                            p2_pct += diff
-
-                                    twins_data = {
-                                        'count': t_count,
-                                        'p1': p1_pct,
-                                        'x': x_pct,
-                                        'p2': p2_pct
-                                    }
-
-                            # --- УДАЛЕН ВЕКТОРНЫЙ СИНТЕЗ ---
-                            # Вердикт больше не рассчитывается
-
-                            # --- СОХРАНЕНИЕ РЕЗУЛЬТАТА ---
-                            results.append({
-                                'match': f"{home_team.name} - {away_team.name}",
-                                'league': league.name if league else "Unknown",
-                                'poisson_l': f"{p_data['home_lambda']} : {p_data['away_lambda']}",
-                                'poisson_top': top_scores,
-                                'poisson_btts': {
-                                    'yes': poisson_results['btts_yes'],
-                                    'no': poisson_results['btts_no']
-                                },
-                                'poisson_over25': {
-                                    'yes': poisson_results['over25_yes'],
-                                    'no': poisson_results['over25_no']
-                                },
-                                'twins_count': t_count,
-                                'twins_data': twins_data,
-                                'pattern_data': pattern_data,
-                                'current_h_form': curr_h_form,
-                                'current_a_form': curr_a_form,
-                                'h2h_list': h2h_list,
-                                'h2h_total': len(h2h_list),
-                                'odds': (
-                                    float(h_odd) if h_odd is not None else None,
-                                    float(d_odd) if d_odd is not None else None,
-                                    float(a_odd) if a_odd is not None else None
-                                ),
-                                'historical_total': historical_total_insight.get('synthetic'),
-                                # 'verdict' поле удалено
-                            })
-
-                        else:
-                            if not home_team:
-                                unknown_teams.add(home_raw.strip())
-                            if not away_team:
-                                unknown_teams.add(away_raw.strip())
-
-                except (IndexError, ValueError, Exception) as e:
-                    logger.error(f"Error processing line {i}: {e}")
-                    continue
+            if not ODDS_LINE_RE.match(line):
+                if self._is_team_name_candidate(line):
+                    recent_names.append((i, line))
+                continue
 
-        # --- СОХРАНЕНИЕ РЕЗУЛЬТАТОВ В СЕССИЮ ---
-        if results:
-            request.session['original_results'] = [dict(r) for r in results]
-        else:
-            request.session['original_results'] = []
+            try:
+                # Парсинг коэффициентов
+                h_odd = Decimal(line.replace(',', '.')).quantize(ODDS_QUANT)
+                d_odd = Decimal(lines[i + 1].replace(',', '.')).quantize(ODDS_QUANT)
+                a_odd = Decimal(lines[i + 2].replace(',', '.')).quantize(ODDS_QUANT)
+                skip_to = i + 2
 
-        if results:
-            if current_sort == 'btts_desc':
-                results.sort(key=lambda x: x['poisson_btts']['yes'], reverse=True)
-            elif current_sort == 'over25_desc':
-                results.sort(key=lambda x: x['poisson_over25']['yes'], reverse=True)
-            elif current_sort == 'twins_p1_desc':
-                results.sort(
-                    key=lambda x: max(
-                        x.get('twins_data', {}).get('p1', 0) if x.get('twins_data') else 0,
-                        x.get('twins_data', {}).get('p2', 0) if x.get('twins_data') else 0
-                    ),
-                    reverse=True
+                # Два ближайших кандидата выше кэфов (сначала гости, затем хозяева)
+                window_start = i - ParsingConstants.MAX_SEARCH_DEPTH
+                names = [row for j, row in reversed(recent_names) if j >= window_start][:2]
+
+                if len(names) == 2:
+                    away_raw, home_raw = names[0], names[1]
+                    parsed_matches.append((i, h_odd, d_odd, a_odd, home_raw, away_raw))
+
+            except (IndexError, ValueError, Exception) as e:
+                logger.error(f"Error processing line {i}: {e}")
+                continue
+
+        # --- ПОИСК КОМАНД ---
+        # Один запрос к алиасам на все названия из текста вместо поиска на каждый матч
+        clean_names = {}
+        for *_, home_raw, away_raw in parsed_matches:
+            for raw in (home_raw, away_raw):
+                if raw not in clean_names:
+                    clean_names[raw] = self.clean_team_name(raw)
+
+        team_map = {}
+        if clean_names:
+            needed_names = set(clean_names.values())
+            team_ids = {}
+            # Поиск по индексу name_ci; при совпадении названий берется команда с меньшим id
+            for name_ci, team_id in (Team.objects.filter(name_ci__in=needed_names)
+                                     .order_by('id').values_list('name_ci', 'id')):
+                team_ids.setdefault(name_ci, team_id)
+            # Алиасы имеют приоритет над названиями (хранятся в нижнем регистре)
+            team_ids.update(
+                TeamAlias.objects.filter(name__in=needed_names).values_list('name', 'team_id')
+            )
+            teams = Team.objects.in_bulk(set(team_ids.values()))
+            team_map = {name: teams[team_id] for name, team_id in team_ids.items()}
+
+        # Матчи с нераспознанными командами отбрасываются сразу:
+        # для них не нужны ни история, ни расчеты
+        resolved_matches = []
+        for i, h_odd, d_odd, a_odd, home_raw, away_raw in parsed_matches:
+            home_team = team_map.get(clean_names[home_raw])
+            away_team = team_map.get(clean_names[away_raw])
+
+            if home_team and away_team:
+                resolved_matches.append((i, h_odd, d_odd, a_odd, home_raw, away_raw, home_team, away_team))
+            else:
+                if not home_team:
+                    unknown_teams.add(home_raw.strip())
+                if not away_team:
+                    unknown_teams.add(away_raw.strip())
+
+        # --- ЗАГРУЗКА ДАННЫХ ДЛЯ ОПТИМИЗАЦИИ ---
+        # Кортежи вместо моделей: в анализе читаются только id и числовые поля,
+        # гидратация Match и select_related здесь не нужны.
+        # (id, league_id, season_id, home_team_id, away_team_id,
+        #  home_score_reg, away_score_reg, odds_home, odds_away)
+        # Если распознанных матчей нет, история не загружается вовсе.
+        all_matches = []
+        all_leagues = {}
+        leagues_by_country = {}
+        if resolved_matches:
+            all_leagues = {
+                league.id: league for league in League.objects.select_related('country').order_by('pk')
+            }
+            # Первая лига каждой страны — запасной вариант, если по матчам лига не найдена
+            for league in all_leagues.values():
+                leagues_by_country.setdefault(league.country_id, league)
+
+            # История грузится только по лигам, которые могут понадобиться:
+            # где играли команды из текста, и запасные лиги их стран
+            team_ids = {team.id for *_, home_team, away_team in resolved_matches for team in (home_team, away_team)}
+            league_ids = set(Match.objects.filter(
+                Q(home_team_id__in=team_ids) | Q(away_team_id__in=team_ids),
+                home_score_reg__isnull=False
+            ).values_list('league_id', flat=True).distinct())
+            for *_, home_team, away_team in resolved_matches:
+                fallback_league = leagues_by_country.get(home_team.country_id)
+                if fallback_league:
+                    league_ids.add(fallback_league.id)
+
+            all_matches = list(Match.objects.filter(
+                home_score_reg__isnull=False, league_id__in=league_ids
+            ).order_by('date', 'id').values_list(
+                'id', 'league_id', 'season_id', 'home_team_id', 'away_team_id',
+                'home_score_reg', 'away_score_reg', 'odds_home', 'odds_away'
+            ))
+
+        # Индексация матчей по лиге для быстрого доступа
+        matches_by_league = {}
+
+        # Индексы для определения лиги: первый по дате матч пары команд,
+        # хозяев и гостей — отдельно для текущего сезона и для всей истории.
+        # Строятся один раз вместо полного прохода по истории на каждый матч.
+        current_pair_league, current_home_league, current_away_league = {}, {}, {}
+        history_pair_league, history_home_league, history_away_league = {}, {}, {}
+
+        for match in all_matches:
+            _, l_id, s_id, h_id, a_id = match[:5]
+            if l_id not in matches_by_league:
+                matches_by_league[l_id] = []
+            matches_by_league[l_id].append(match)
+
+            pair = (h_id, a_id) if h_id < a_id else (a_id, h_id)
+            history_pair_league.setdefault(pair, l_id)
+            history_home_league.setdefault(h_id, l_id)
+            history_away_league.setdefault(a_id, l_id)
+            if season and s_id == season.id:
+                current_pair_league.setdefault(pair, l_id)
+                current_home_league.setdefault(h_id, l_id)
+                current_away_league.setdefault(a_id, l_id)
+
+        # --- ЛИЧНЫЕ ВСТРЕЧИ ОДНИМ ЗАПРОСОМ ---
+        # Последние 10 сыгранных встреч для каждой пары (хозяин, гость) из текста
+        h2h_pairs = {(home_team.id, away_team.id) for *_, home_team, away_team in resolved_matches}
+
+        h2h_by_pair = {}
+        if h2h_pairs:
+            h2h_filter = Q()
+            for h_id, a_id in h2h_pairs:
+                h2h_filter |= Q(home_team_id=h_id, away_team_id=a_id)
+            h2h_rows = Match.objects.filter(
+                h2h_filter, home_score_reg__isnull=False
+            ).order_by('-date').values_list(
+                'home_team_id', 'away_team_id', 'date', 'home_score_reg', 'away_score_reg'
+            )
+            for h_id, a_id, m_date, hs, as_ in h2h_rows:
+                pair_matches = h2h_by_pair.setdefault((h_id, a_id), [])
+                if len(pair_matches) < 10:
+                    pair_matches.append({
+                        'date': m_date.strftime(Messages.DATE_FORMAT),
+                        'score': f"{hs}:{as_}"
+                    })
+
+        # --- АНАЛИЗ МАТЧЕЙ ---
+        # league_id -> (form_bits, form_len, pattern_stats), см. build_league_forms
+        league_forms_cache = {}
+        # league_id -> (кэфы П1, кэфы П2, исходы), см. build_league_odds
+        league_odds_cache = {}
+        for i, h_odd, d_odd, a_odd, home_raw, away_raw, home_team, away_team in resolved_matches:
+            try:
+                # --- ОПРЕДЕЛЕНИЕ ЛИГИ (по текущему сезону) ---
+                league = None
+
+                pair = ((home_team.id, away_team.id) if home_team.id < away_team.id
+                        else (away_team.id, home_team.id))
+
+                # 1. Сначала ищем матчи между этими командами в ТЕКУЩЕМ сезоне
+                if pair in current_pair_league:
+                    league = all_leagues.get(current_pair_league[pair])
+                    logger.info(f"Лига найдена по личным встречам в текущем сезоне: {league.name}")
+
+                # 2. Если не нашли, ищем матчи home_team в текущем сезоне
+                elif home_team.id in current_home_league:
+                    league = all_leagues.get(current_home_league[home_team.id])
+                    logger.info(
+                        f"Лига найдена по домашним матчам {home_team.name} в текущем сезоне: {league.name}")
+
+                # 3. Если не нашли, ищем матчи away_team в текущем сезоне
+                elif away_team.id in current_away_league:
+                    league = all_leagues.get(current_away_league[away_team.id])
+                    logger.info(
+                        f"Лига найдена по гостевым матчам {away_team.name} в текущем сезоне: {league.name}")
+
+                # 4. Если все еще не нашли, ищем в истории (любой сезон)
+                elif pair in history_pair_league:
+                    league = all_leagues.get(history_pair_league[pair])
+                    logger.info(f"Лига найдена по личным встречам в истории: {league.name}")
+
+                # 5. Если не нашли, ищем по домашним матчам home_team в истории
+                elif home_team.id in history_home_league:
+                    league = all_leagues.get(history_home_league[home_team.id])
+                    logger.info(
+                        f"Лига найдена по домашним матчам {home_team.name} в истории: {league.name}")
+
+                # 6. Если не нашли, ищем по гостевым матчам away_team в истории
+                elif away_team.id in history_away_league:
+                    league = all_leagues.get(history_away_league[away_team.id])
+                    logger.info(
+                        f"Лига найдена по гостевым матчам {away_team.name} в истории: {league.name}")
+
+                # 7. Если ничего не нашли, пробуем по стране
+                if not league:
+                    # По country_id без загрузки home_team.country; страна лиги та же
+                    league = leagues_by_country.get(home_team.country_id)
+                    if league:
+                        logger.info(f"Лига найдена по стране {league.country}: {league.name}")
+
+                if not league:
+                    unknown_teams.add(home_raw.strip())
+                    unknown_teams.add(away_raw.strip())
+                    continue
+
+                league_matches = matches_by_league.get(league.id, [])
+
+                # --- ИСТОРИЧЕСКИЙ ПАТТЕРН (только текущий сезон) ---
+                # Формы текущего сезона и статистика паттернов зависят только от лиги,
+                # поэтому считаются один раз на лигу, а не на каждый матч из текста
+                league_forms = league_forms_cache.get(league.id)
+                if league_forms is None:
+                    league_forms = league_forms_cache[league.id] = self.build_league_forms(
+                        league_matches, season)
+                form_bits, form_len, pattern_stats = league_forms
+                form_length = AnalysisConstants.PATTERN_FORM_LENGTH
+
+                # Последние 4 матча каждой команды (строка нужна только для вывода)
+                curr_h_bits, curr_h_len = form_bits.get(home_team.id, 0), form_len.get(home_team.id, 0)
+                curr_a_bits, curr_a_len = form_bits.get(away_team.id, 0), form_len.get(away_team.id, 0)
+                curr_h_form = unpack_form(curr_h_bits, min(curr_h_len, form_length))
+                curr_a_form = unpack_form(curr_a_bits, min(curr_a_len, form_length))
+
+                pattern_data = None
+                p_hw, p_dw, p_aw, p_count = 0, 0, 0, 0
+
+                # Поиск матчей с таким же паттерном
+                if curr_h_len >= form_length and curr_a_len >= form_length:
+                    curr_key = (curr_h_bits << (2 * form_length)) | curr_a_bits
+                    p_hw, p_dw, p_aw = pattern_stats.get(curr_key, (0, 0, 0))
+                    p_count = p_hw + p_dw + p_aw
+
+                    if p_count > 0:
+                        p1_pct, x_pct, p2_pct = self.round_percentages(p_hw, p_dw, p_aw)
+
+                        pattern_data = {
+                            'pattern': f"{curr_h_form} - {curr_a_form}",
+                            'count': p_count,
+                            'p1': p1_pct,
+                            'x': x_pct,
+                            'p2': p2_pct
+                        }
+
+                # --- ЛИЧНЫЕ ВСТРЕЧИ (только где home_team - хозяин, away_team - гость) ---
+                h2h_list = list(h2h_by_pair.get((home_team.id, away_team.id), ()))
+
+                # --- ПУАССОН ---
+                m_obj = Match(
+                    home_team=home_team,
+                    away_team=away_team,
+                    league=league,
+                    season=season,
+                    odds_home=h_odd
                 )
-            elif current_sort == 'pattern_p1_desc':
-                results.sort(
-                    key=lambda x: max(
-                        x.get('pattern_data', {}).get('p1', 0) if x.get('pattern_data') else 0,
-                        x.get('pattern_data', {}).get('p2', 0) if x.get('pattern_data') else 0
+                p_data = m_obj.calculate_poisson_lambda_last_n(AnalysisConstants.LAMBDA_LAST_N)
+                poisson_results = self.get_poisson_probs(p_data['home_lambda'], p_data['away_lambda'])
+                top_scores = poisson_results['top_scores']
+                historical_total_insight = m_obj.get_historical_total_insight()
+
+                # --- БЛИЗНЕЦЫ ---
+                # Оба допуска за один проход; расширенный — только если в малом пусто
+                league_odds = league_odds_cache.get(league.id)
+                if league_odds is None:
+                    league_odds = league_odds_cache[league.id] = self.build_league_odds(league_matches)
+                small_counts, large_counts = self.tally_twins(league_odds, h_odd, a_odd, TWINS_TOLERANCES)
+                hw_t, dw_t, aw_t = small_counts if any(small_counts) else large_counts
+
+                t_count = hw_t + dw_t + aw_t
+                twins_data = None
+
+                if t_count > 0:
+                    p1_pct, x_pct, p2_pct = self.round_percentages(hw_t, dw_t, aw_t)
+
+                    twins_data = {
+                        'count': t_count,
+                        'p1': p1_pct,
+                        'x': x_pct,
+                        'p2': p2_pct
+                    }
+
+                # --- УДАЛЕН ВЕКТОРНЫЙ СИНТЕЗ ---
+                # Вердикт больше не рассчитывается
+
+                # --- СОХРАНЕНИЕ РЕЗУЛЬТАТА ---
+                results.append({
+                    'match': f"{home_team.name} - {away_team.name}",
+                    'league': league.name if league else "Unknown",
+                    'poisson_l': f"{p_data['home_lambda']} : {p_data['away_lambda']}",
+                    'poisson_top': top_scores,
+                    'poisson_btts': {
+                        'yes': poisson_results['btts_yes'],
+                        'no': poisson_results['btts_no']
+                    },
+                    'poisson_over25': {
+                        'yes': poisson_results['over25_yes'],
+                        'no': poisson_results['over25_no']
+                    },
+                    'twins_count': t_count,
+                    'twins_data': twins_data,
+                    'pattern_data': pattern_data,
+                    'current_h_form': curr_h_form,
+                    'current_a_form': curr_a_form,
+                    'h2h_list': h2h_list,
+                    'h2h_total': len(h2h_list),
+                    'odds': (
+                        float(h_odd) if h_odd is not None else None,
+                        float(d_odd) if d_odd is not None else None,
+                        float(a_odd) if a_odd is not None else None
                     ),
-                    reverse=True
-                )
+                    'historical_total': historical_total_insight.get('synthetic'),
+                    # 'verdict' поле удалено
+                })
+
+            except (IndexError, ValueError, Exception) as e:
+                logger.error(f"Error processing line {i}: {e}")
+                continue
+
+        # Исходный порядок хранится в самих результатах (_ord), а не отдельной
+        # копией списка в сессии
+        for order, result in enumerate(results):
+            result['_ord'] = order
+            self.add_sort_keys(result)
+
+        if results:
+            self.sort_results(results, current_sort)
 
         # Удалена фильтрация по verdict
 
-        request.session['results'] = results
-        request.session['raw_text'] = raw_text
+        # --- СОХРАНЕНИЕ РЕЗУЛЬТАТОВ ---
+        # Результаты и текст — в кэш, в сессии только ключ и мелкие поля
+        save_analysis(request, results, raw_text)
         request.session['unknown_teams'] = list(unknown_teams)
         request.session['current_sort'] = current_sort
 
@@ -695,7 +901,7 @@ class AnalyzeView(View):
             'results': results,
             'raw_text': raw_text,
             'unknown_teams': sorted(list(unknown_teams)),
-            'all_teams': Team.objects.all().order_by('name'),
+            'all_teams': get_sorted_teams(),
             'current_sort': current_sort,
         })
 
@@ -704,9 +910,17 @@ class CleanedTemplateView(TemplateView):
     template_name = 'app_bets/cleaned.html'
 
     def get_league_mapping(self):
-        leagues = League.objects.all()
+        """Кэшируется в памяти процесса на LEAGUE_CODES_TIMEOUT; сигналы сбрасывают только текущий процесс."""
+        return cache.get_or_set(
+            CacheConstants.LEAGUE_CODES_KEY,
+            self.build_league_mapping,
+            CacheConstants.LEAGUE_CODES_TIMEOUT
+        )
+
+    @staticmethod
+    def build_league_mapping():
         mapping = {}
-        for league in leagues:
+        for league in League.objects.select_related('country'):
             mapping[league.name] = league.external_id
             mapping[f"{league.name} ({league.country.name})"] = league.external_id
         return mapping
@@ -715,8 +929,8 @@ class CleanedTemplateView(TemplateView):
         pickle_path = os.path.join(settings.BASE_DIR, 'calibration_summary.pkl')
         if not os.path.exists(pickle_path):
             return None
-        with open(pickle_path, 'rb') as f:
-            df = pickle.load(f)
+        # Файл разбирается один раз на версию; копия — чтобы не портить кэш
+        df = _load_calibration_frame(pickle_path, os.path.getmtime(pickle_path)).copy()
         league_map = self.get_league_mapping()
         df['external_id'] = df['league'].map(league_map)
         df = df.dropna(subset=['external_id'])
@@ -726,35 +940,69 @@ class CleanedTemplateView(TemplateView):
         excel_path = os.path.join(settings.BASE_DIR, 'for_analyze_matches.xlsx')
         if not os.path.exists(excel_path):
             return None
-        df = pd.read_excel(excel_path)
+        df = _load_excel_frame(excel_path, os.path.getmtime(excel_path))
         required = ['Время', 'Хозяева', 'Гости', 'ТБ2,5', 'ТМ2,5']
         if not all(col in df.columns for col in required):
             return None
         return df
 
-    def find_team(self, name):
-        try:
-            return Team.objects.get(Q(aliases__name__iexact=name) | Q(name__iexact=name))
-        except Team.DoesNotExist:
-            return None
-        except Team.MultipleObjectsReturned:
-            return Team.objects.filter(Q(aliases__name__iexact=name) | Q(name__iexact=name)).first()
+    def find_teams(self, names) -> Dict[str, 'Team']:
+        """
+        Команды для названий из Excel по имени или алиасу (без учета регистра)
+        двумя запросами на весь файл. Каждое исходное написание названия получает свою запись.
+        При нескольких совпадениях — команда с меньшим id, как у прежнего
+        Team.objects.filter(Q(aliases__name__iexact=...) | Q(name__iexact=...)).first()
+        (у Team нет Meta.ordering, поэтому first() сортирует по pk).
+        """
+        spellings = defaultdict(set)
+        for name in names:
+            if isinstance(name, str):
+                spellings[name.lower()].add(name)
+        if not spellings:
+            return {}
+        # Равенство по индексированным колонкам в нижнем регистре (Team.name_ci и
+        # TeamAlias.name, который приводится к нижнему регистру при сохранении) вместо iexact
+        found_ids = {}
+        pairs = chain(
+            Team.objects.filter(name_ci__in=spellings).values_list('name_ci', 'id'),
+            TeamAlias.objects.filter(name__in=spellings).values_list('name', 'team_id'),
+        )
+        for key, team_id in pairs:
+            if team_id < found_ids.get(key, team_id + 1):
+                found_ids[key] = team_id
+        teams = Team.objects.in_bulk(set(found_ids.values()))
+        return {
+            name: teams[team_id]
+            for key, team_id in found_ids.items()
+            for name in spellings[key]
+        }
 
-    def get_league_for_team(self, team):
-        last_match = Match.objects.filter(
-            Q(home_team=team) | Q(away_team=team)
-        ).select_related('league').order_by('-date').first()
-        return last_match.league if last_match else None
+    def get_last_leagues(self, teams) -> Dict[int, 'League']:
+        """Лига последнего по дате матча каждой команды (team_id -> League) одним запросом."""
+        team_ids = {team.id for team in teams}
+        last_league_ids = {}
+        rows = Match.objects.filter(
+            Q(home_team_id__in=team_ids) | Q(away_team_id__in=team_ids)
+        ).order_by('-date', '-id').values_list('home_team_id', 'away_team_id', 'league_id')
+        for home_id, away_id, league_id in rows:
+            for team_id in (home_id, away_id):
+                if team_id in team_ids:
+                    last_league_ids.setdefault(team_id, league_id)
+            if len(last_league_ids) == len(team_ids):
+                break
+        leagues = League.objects.in_bulk(set(last_league_ids.values()))
+        return {team_id: leagues[league_id] for team_id, league_id in last_league_ids.items()}
 
     def calculate_probs_for_match(self, home_team, away_team, league, n_values):
         results = []
+        # Один несохраненный матч на все n: от n зависит только глубина выборки
+        temp_match = Match(
+            home_team=home_team,
+            away_team=away_team,
+            league=league,
+            season=None
+        )
         for n in n_values:
-            temp_match = Match(
-                home_team=home_team,
-                away_team=away_team,
-                league=league,
-                season=None
-            )
             lambdas = temp_match.calculate_poisson_lambda_last_n(n=n)
             if 'error' in lambdas:
                 continue
@@ -768,35 +1016,74 @@ class CleanedTemplateView(TemplateView):
             })
         return results
 
-    def poisson_over_prob(self, l_home, l_away, max_goals=10):
-        import math
-        def poisson(l, k):
-            return math.exp(-l) * (l**k) / math.factorial(k)
-        over = 0.0
-        for h in range(max_goals+1):
-            for a in range(max_goals+1):
-                if h + a > 2.5:
-                    over += poisson(l_home, h) * poisson(l_away, a)
-        return over
-
-    def find_calibration(self, calib_df, league, target, n, prob):
-        league_code = league.external_id
-        subset = calib_df[(calib_df['external_id'] == league_code) &
-                          (calib_df['target'] == target) &
-                          (calib_df['last_matches'] == n)]
-        if subset.empty:
+    def poisson_over_prob(self, l_home, l_away):
+        """
+        Вероятность ТБ 2.5: сумма голов двух независимых пуассоновских величин
+        распределена по Пуассону с λ = λ1 + λ2, поэтому ТБ 2.5 = 1 - P(0) - P(1) - P(2).
+        """
+        total_lambda = l_home + l_away
+        p0 = math.exp(-total_lambda)
+        p1 = p0 * total_lambda
+        p2 = p1 * total_lambda / 2
+        return 1.0 - (p0 + p1 + p2)
+
+    @staticmethod
+    def build_calibration_index(calib_df) -> Dict[tuple, tuple]:
+        """
+        Индекс калибровки (external_id, target, last_matches) -> массивы границ, actual_% и
+        подписей интервалов. Порядок строк внутри группы сохраняется
+        (при пересечении интервалов побеждает первый, как раньше),
+        строки с неразобранными границами интервала пропускаются.
+        """
+        index = {}
+        calib_df = calib_df.dropna(subset=['iv_low', 'iv_high'])
+        for key, group in calib_df.groupby(['external_id', 'target', 'last_matches'], sort=False):
+            index[key] = (
+                group['iv_low'].to_numpy(), group['iv_high'].to_numpy(),
+                group['actual_%'].tolist(), group['interval'].tolist(),
+            )
+        return index
+
+    @staticmethod
+    def calibration_ceilings(calib_index) -> Dict[tuple, float]:
+        """Максимальный actual_% по (external_id, target) среди всех n — верхняя граница EV."""
+        ceilings = {}
+        for (league_code, target, _), (_, _, actuals, _) in calib_index.items():
+            values = [actual for actual in actuals if not pd.isna(actual)]
+            if values:
+                key = (league_code, target)
+                ceilings[key] = max(ceilings.get(key, values[0]), *values)
+        return ceilings
+
+    def find_calibration(self, calib_index, league, target, n, prob):
+        group = calib_index.get((league.external_id, target, n))
+        if group is None:
             return None, None
+        lows, highs, actuals, intervals = group
         prob_pct = prob * 100
-        for _, row in subset.iterrows():
-            interval = row['interval']
-            if interval.startswith('>'):
-                low = float(interval[1:])
-                high = 100
-            else:
-                low, high = map(float, interval.split('-'))
-            if low <= prob_pct < high:
-                return row['actual_%'], interval
-        return None, None
+        hits = np.flatnonzero((lows <= prob_pct) & (prob_pct < highs))
+        if not hits.size:
+            return None, None
+        i = hits[0]
+        return actuals[i], intervals[i]
+
+    @staticmethod
+    def format_match_times(times) -> List[str]:
+        """Время матчей в виде 'ЧЧ:ММ'; значения без strftime выводятся как есть."""
+        if pd.api.types.is_datetime64_any_dtype(times):
+            return times.dt.strftime('%H:%M').tolist()
+        # Время в файле повторяется, поэтому каждое значение форматируется один раз
+        formatted = {
+            value: value.strftime('%H:%M') if hasattr(value, 'strftime') else str(value)
+            for value in times.unique()
+        }
+        return times.map(formatted).tolist()
+
+    @staticmethod
+    def odds_column(odds) -> List[Optional[float]]:
+        """Коэффициенты колонки одним приведением; пустые и нечисловые ячейки — None."""
+        values = pd.to_numeric(odds, errors='coerce')
+        return [None if pd.isna(value) else value for value in values.astype(float).tolist()]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -810,28 +1097,37 @@ class CleanedTemplateView(TemplateView):
 
         n_values = list(range(5, 11))
         analysis_results = []
+        calib_index = self.build_calibration_index(calib_df)
+        calib_ceilings = self.calibration_ceilings(calib_index)
 
-        for idx, row in excel_df.iterrows():
-            match_time = row['Время']
-            if hasattr(match_time, 'strftime'):
-                time_str = match_time.strftime('%H:%M')
-            else:
-                time_str = str(match_time)
-
-            home_name = row['Хозяева']
-            away_name = row['Гости']
-            odds_over = float(row['ТБ2,5']) if not pd.isna(row['ТБ2,5']) else None
-            odds_under = float(row['ТМ2,5']) if not pd.isna(row['ТМ2,5']) else None
+        # Команды и их последние лиги — заранее на весь файл, а не запросами на строку
+        teams_by_name = self.find_teams(set(excel_df['Хозяева']) | set(excel_df['Гости']))
+        last_leagues = self.get_last_leagues(teams_by_name.values())
 
-            home_team = self.find_team(home_name)
-            away_team = self.find_team(away_name)
+        rows = zip(
+            self.format_match_times(excel_df['Время']),
+            excel_df['Хозяева'], excel_df['Гости'],
+            self.odds_column(excel_df['ТБ2,5']), self.odds_column(excel_df['ТМ2,5']),
+        )
+        for time_str, home_name, away_name, odds_over, odds_under in rows:
+            home_team = teams_by_name.get(home_name)
+            away_team = teams_by_name.get(away_name)
             if not home_team or not away_team:
                 continue
 
-            league = self.get_league_for_team(home_team) or self.get_league_for_team(away_team)
+            league = last_leagues.get(home_team.id) or last_leagues.get(away_team.id)
             if not league:
                 continue
 
+            # Расчет лямбд (запросы к БД) пропускается, если ни один исход не может дать EV > 0
+            # даже при максимальной фактической вероятности калибровки лиги
+            if not any(
+                odds is not None and (league.external_id, target) in calib_ceilings
+                and (calib_ceilings[(league.external_id, target)] / 100.0) * odds - 1 > 0
+                for target, odds in (('over', odds_over), ('under', odds_under))
+            ):
+                continue
+
             probs = self.calculate_probs_for_match(home_team, away_team, league, n_values)
             if not probs:
                 continue
@@ -845,8 +1141,10 @@ class CleanedTemplateView(TemplateView):
             best_odds = None
 
             for p in probs:
-                actual_over, interval_over = self.find_calibration(calib_df, league, 'over', p['n'], p['over_prob'])
-                if actual_over is not None and odds_over is not None:
+                actual_over = interval_over = None
+                if odds_over is not None:
+                    actual_over, interval_over = self.find_calibration(calib_index, league, 'over', p['n'], p['over_prob'])
+                if actual_over is not None:
                     ev_over = (actual_over / 100.0) * odds_over - 1
                     if ev_over > 0 and (best_ev is None or ev_over > best_ev):
                         best_ev = ev_over
@@ -857,8 +1155,10 @@ class CleanedTemplateView(TemplateView):
                         best_prob = p['over_prob']
                         best_odds = odds_over
 
-                actual_under, interval_under = self.find_calibration(calib_df, league, 'under', p['n'], p['under_prob'])
-                if actual_under is not None and odds_under is not None:
+                actual_under = interval_under = None
+                if odds_under is not None:
+                    actual_under, interval_under = self.find_calibration(calib_index, league, 'under', p['n'], p['under_prob'])
+                if actual_under is not None:
                     ev_under = (actual_under / 100.0) * odds_under - 1
                     if ev_under > 0 and (best_ev is None or ev_under > best_ev):
                         best_ev = ev_under
@@ -892,12 +1192,12 @@ class CleanedTemplateView(TemplateView):
                 })
 
         analysis_results.sort(key=lambda x: x['time'])
-        self.request.session['cleaned_analysis_results'] = analysis_results
+        save_cleaned_analysis(self.request, analysis_results)
         context['analysis_results'] = analysis_results
         return context
 
 
-class UploadCSVView(View):
+class UploadCSVView(MatchCSVImporter, View):
     template_name = 'app_bets/bets_main.html'
 
     def post(self, request):
@@ -905,7 +1205,7 @@ class UploadCSVView(View):
             'results': [],
             'raw_text': '',
             'unknown_teams': [],
-            'all_teams': Team.objects.all(),
+            'all_teams': get_sorted_teams(),
             'import_status': 'success',
             'import_message': '',
             'import_added': 0,
@@ -945,7 +1245,8 @@ class UploadCSVView(View):
                 context['import_message'] = f'Папка {import_data_dir} не найдена.'
                 return render(request, self.template_name, context)
 
-            csv_files = [f for f in os.listdir(import_data_dir) if f.endswith('.csv')]
+            with os.scandir(import_data_dir) as entries:
+                csv_files = [entry for entry in entries if entry.name.endswith('.csv') and entry.is_file()]
 
             if not csv_files:
                 context['import_status'] = 'warning'
@@ -962,9 +1263,8 @@ class UploadCSVView(View):
 
             self.request = request
 
-            for csv_file_name in csv_files:
-                file_path = os.path.join(import_data_dir, csv_file_name)
-                result = self.process_csv_file(file_path)
+            for entry, frame in self.iter_csv_frames(csv_files):
+                result = self.process_csv_file(entry.path, frame)
                 total_added += result['added']
                 total_skipped += result['skipped']
                 total_errors += result['errors']
@@ -976,7 +1276,7 @@ class UploadCSVView(View):
                         all_unknown_teams.add(team['name'])
 
                 details.append(
-                    f"{csv_file_name}: +{result['added']} "
+                    f"{entry.name}: +{result['added']} "
                     f"(пропущено {result['skipped']}, "
                     f"ошибок {result['errors']}, "
                     f"алиасов {result.get('created_aliases', 0)})"
@@ -1025,23 +1325,8 @@ class UploadCSVView(View):
 
     def import_from_file(self, request, csv_file, context):
         try:
-            try:
-                file_content = csv_file.read().decode('utf-8-sig')
-            except UnicodeDecodeError:
-                csv_file.seek(0)
-                file_content = csv_file.read().decode('latin-1')
-
-            import tempfile
-
-            with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', suffix='.csv', delete=False) as tmp:
-                tmp.write(file_content)
-                tmp_path = tmp.name
-
-            try:
-                result = self.process_csv_file(tmp_path)
-            finally:
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
+            # Загруженный файл читается pandas напрямую, без копии во временный файл
+            result = self.process_csv_file(csv_file)
 
             context['import_added'] = result['added']
             context['import_skipped'] = result['skipped']
@@ -1068,234 +1353,45 @@ class UploadCSVView(View):
 
         return render(request, self.template_name, context)
 
-    @transaction.atomic
-    def process_csv_file(self, file_path):
-        count = 0
-        skipped = 0
-        errors = 0
-        processed = 0
-        created_aliases = 0
-        unknown_teams_list = []
-
-        all_teams = {team.id: team for team in Team.objects.all()}
-        all_teams_by_name = {team.name.lower(): team for team in Team.objects.all()}
-        all_aliases = {}
-        for alias in TeamAlias.objects.all().select_related('team'):
-            all_aliases[alias.name] = alias.team
-        all_leagues = {league.name: league for league in League.objects.all()}
-
-        def find_team_smart(team_name, all_teams_dict, all_aliases_dict, all_teams_by_name_dict):
-            nonlocal created_aliases, unknown_teams_list
-
-            if not team_name:
-                return None
-
-            clean_name = self.clean_team_name(team_name)
-
-            if clean_name in all_aliases_dict:
-                return all_aliases_dict[clean_name]
-
-            if clean_name in all_teams_by_name_dict:
-                team = all_teams_by_name_dict[clean_name]
-                alias, created = TeamAlias.objects.get_or_create(
-                    name=clean_name,
-                    defaults={'team': team}
-                )
-                if created:
-                    created_aliases += 1
-                    all_aliases_dict[clean_name] = team
-                return team
-
-            best_match = None
-            best_score = 0
-
-            for team_name_db, team in all_teams_by_name_dict.items():
-                if clean_name in team_name_db:
-                    score = len(clean_name) / len(team_name_db)
-                    if score > best_score:
-                        best_score = score
-                        best_match = team
-                elif team_name_db in clean_name:
-                    score = len(team_name_db) / len(clean_name)
-                    if score > best_score:
-                        best_score = score
-                        best_match = team
-
-            if best_match and best_score > 0.6:
-                alias, created = TeamAlias.objects.get_or_create(
-                    name=clean_name,
-                    defaults={'team': best_match}
-                )
-                if created:
-                    created_aliases += 1
-                    all_aliases_dict[clean_name] = best_match
-                return best_match
-
-            unknown_teams_list.append({
-                'name': team_name,
-                'clean_name': clean_name
-            })
-            return None
-
-        try:
-            with open(file_path, mode='r', encoding='utf-8-sig') as f:
-                first_line = f.readline()
-                f.seek(0)
-
-                delimiter = ';' if ';' in first_line else ','
-                reader = csv.DictReader(f, delimiter=delimiter)
-
-                for row in reader:
-                    processed += 1
-                    try:
-                        div_code = row.get('Div', '').strip()
-                        if not div_code:
-                            skipped += 1
-                            continue
-
-                        league_name = ParsingConstants.DIV_TO_LEAGUE_NAME.get(div_code)
-                        if not league_name:
-                            skipped += 1
-                            continue
-
-                        league = all_leagues.get(league_name)
-                        if not league:
-                            skipped += 1
-                            continue
-
-                        date_str = row.get('Date', '').strip()
-                        if not date_str:
-                            skipped += 1
-                            continue
-
-                        try:
-                            dt = datetime.strptime(date_str, '%d/%m/%Y')
-                        except ValueError:
-                            try:
-                                dt = datetime.strptime(date_str, '%d/%m/%y')
-                            except ValueError:
-                                try:
-                                    dt = datetime.strptime(date_str, '%Y-%m-%d')
-                                except ValueError:
-                                    errors += 1
-                                    continue
-
-                        season = self.get_season_by_date(dt)
-                        if not season:
-                            season = Season.objects.filter(
-                                start_date__lte=dt.date(),
-                                end_date__gte=dt.date()
-                            ).first()
-                            if not season:
-                                errors += 1
-                                continue
-
-                        home_team_name = row.get('HomeTeam', '').strip()
-                        away_team_name = row.get('AwayTeam', '').strip()
-
-                        if not home_team_name or not away_team_name:
-                            skipped += 1
-                            continue
-
-                        home_team = find_team_smart(home_team_name, all_teams, all_aliases, all_teams_by_name)
-                        away_team = find_team_smart(away_team_name, all_teams, all_aliases, all_teams_by_name)
-
-                        if not home_team or not away_team:
-                            skipped += 1
-                            continue
-
-                        dt_aware = make_aware(dt, get_current_timezone())
-
-                        if Match.objects.filter(
-                                date=dt_aware,
-                                home_team=home_team,
-                                away_team=away_team
-                        ).exists():
-                            skipped += 1
-                            continue
-
-                        odd_h = self.parse_odd(row.get('AvgH') or row.get('B365H') or row.get('PSH') or '1.01')
-                        odd_d = self.parse_odd(row.get('AvgD') or row.get('B365D') or row.get('PSD') or '1.01')
-                        odd_a = self.parse_odd(row.get('AvgA') or row.get('B365A') or row.get('PSA') or '1.01')
-                        h_goal = self.parse_score(row.get('FTHG') or '0')
-                        a_goal = self.parse_score(row.get('FTAG') or '0')
-
-                        Match.objects.create(
-                            season=season,
-                            league=league,
-                            date=dt_aware,
-                            home_team=home_team,
-                            away_team=away_team,
-                            home_score_reg=h_goal,
-                            away_score_reg=a_goal,
-                            home_score_final=h_goal,
-                            away_score_final=a_goal,
-                            odds_home=odd_h,
-                            odds_draw=odd_d,
-                            odds_away=odd_a,
-                            finish_type='REG'
-                        )
-
-                        count += 1
-
-                    except Exception:
-                        errors += 1
-                        continue
-
-        except Exception:
-            errors += 1
-
-        if unknown_teams_list and hasattr(self, 'request'):
+    def process_csv_file(self, source, frame=None):
+        """Импорт файла; нераспознанные команды добавляются в сессию для привязки алиасов."""
+        result = super().process_csv_file(source, frame)
+        if result['unknown_teams_list'] and hasattr(self, 'request'):
             current_unknown = self.request.session.get('unknown_teams', [])
-            new_unknown = list(set([item['name'] for item in unknown_teams_list]))
+            new_unknown = list(set([item['name'] for item in result['unknown_teams_list']]))
             self.request.session['unknown_teams'] = list(set(current_unknown + new_unknown))
-        print(unknown_teams_list)
-        return {
-            'added': count,
-            'skipped': skipped,
-            'errors': errors,
-            'created_aliases': created_aliases,
-            'unknown_teams_list': unknown_teams_list,
-            'unknown_teams': len(unknown_teams_list)
-        }
-
-    @staticmethod
-    def get_team_by_alias(name):
-        if not name:
-            return None
-        clean_alias = " ".join(str(name).split()).lower()
-        alias = TeamAlias.objects.filter(name=clean_alias).select_related('team').first()
-        return alias.team if alias else None
-
-    @staticmethod
-    def get_season_by_date(dt):
-        return Season.objects.filter(start_date__lte=dt.date(), end_date__gte=dt.date()).first()
-
-    @staticmethod
-    def parse_score(val):
-        if not val or str(val).strip() == "" or str(val).lower() == 'nan':
-            return 0
-        try:
-            return int(float(str(val).replace(',', '.')))
-        except (ValueError, TypeError):
-            return 0
+        return result
 
-    @staticmethod
-    def parse_odd(val):
-        if not val or str(val).strip() == "" or str(val).lower() == 'nan':
-            return Decimal('1.01')
-        try:
-            return Decimal(str(val).replace(',', '.')).quantize(Decimal('0.01'))
-        except:
-            return Decimal('1.01')
 
-    @staticmethod
-    def clean_team_name(name: str) -> str:
-        if not name:
-            return ""
-        clean = " ".join(str(name).split()).lower()
-        clean = re.sub(r'[^\w\s]', '', clean)
-        return clean
+def build_export_workbook(title: str, rows: List[list], header_row: int) -> openpyxl.Workbook:
+    """
+    Лист Excel в режиме write_only: строки пишутся потоком, без хранения ячеек в памяти.
+    Ширина колонок считается по значениям заранее (в write_only ее нужно задать до записи строк),
+    строка header_row выделяется жирным.
+    """
+    widths = []
+    for row in rows:
+        widths.extend([0] * (len(row) - len(widths)))
+        for i, value in enumerate(row):
+            if value and len(str(value)) > widths[i]:
+                widths[i] = len(str(value))
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    for i, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = min(width + 2, 30)
+
+    bold = Font(bold=True)
+    for i, row in enumerate(rows):
+        if i == header_row:
+            cells = []
+            for value in row:
+                cell = WriteOnlyCell(ws, value=value)
+                cell.font = bold
+                cells.append(cell)
+            row = cells
+        ws.append(row)
+    return wb
 
 
 class ExportBetsExcelView(View):
@@ -1304,9 +1400,10 @@ class ExportBetsExcelView(View):
     """
 
     def get(self, request, *args, **kwargs):
-        # Получаем результаты из сессии (уже отсортированные)
-        results = request.session.get('results', [])
+        # Результаты последнего анализа в выбранной на странице сортировке
+        results = load_analysis(request)['results']
         current_sort = request.session.get('current_sort', 'default')
+        AnalyzeView.sort_results(results, current_sort)
 
         # Определяем название сортировки
         sort_names = {
@@ -1318,13 +1415,8 @@ class ExportBetsExcelView(View):
         }
         sort_name = sort_names.get(current_sort, 'По умолчанию')
 
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Анализ матчей"
-
         # Заголовок с информацией о сортировке
-        ws.append([f"Сортировка: {sort_name}"])
-        ws.append([])
+        rows = [[f"Сортировка: {sort_name}"], []]
 
         # Заголовки таблицы - оптимизированные, без дублей
         headers = [
@@ -1346,11 +1438,7 @@ class ExportBetsExcelView(View):
             'Ист X',
             'Ист П2',
         ]
-        ws.append(headers)
-
-        # Жирный шрифт для заголовков
-        for cell in ws[2]:
-            cell.font = openpyxl.styles.Font(bold=True)
+        rows.append(headers)
 
         # Заполняем данными
         for res in results:
@@ -1449,19 +1537,10 @@ class ExportBetsExcelView(View):
                 f"{pattern_x}%" if pattern_x != '' else '',  # История (X)
                 f"{pattern_p2}%" if pattern_p2 != '' else '',  # История (П2)
             ]
-            ws.append(row)
+            rows.append(row)
 
-        # Настройка ширины колонок
-        for col in ws.columns:
-            max_length = 0
-            column_letter = col[0].column_letter
-            for cell in col:
-                try:
-                    if cell.value and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            ws.column_dimensions[column_letter].width = min(max_length + 2, 30)
+        # Жирный шрифт для заголовков (третья строка листа)
+        wb = build_export_workbook("Анализ матчей", rows, header_row=2)
 
         response = HttpResponse(
             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -1474,15 +1553,11 @@ class ExportBetsExcelView(View):
 
 class ExportCleanedExcelView(View):
     def get(self, request, *args, **kwargs):
-        results = request.session.get('cleaned_analysis_results', [])
+        results = load_cleaned_analysis(request)
         if not results:
             # Если нет данных, можно вернуть пустой файл или ошибку
             return HttpResponse("Нет данных для экспорта", status=404)
 
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Анализ матчей"
-
         headers = [
             'Время',
             'Хозяева',
@@ -1494,10 +1569,7 @@ class ExportCleanedExcelView(View):
             'Фактическая вероятность, %',
             'EV, %'
         ]
-        ws.append(headers)
-        for cell in ws[1]:
-            cell.font = openpyxl.styles.Font(bold=True)
-
+        rows = [headers]
         for res in results:
             row = [
                 res.get('time', ''),
@@ -1510,16 +1582,9 @@ class ExportCleanedExcelView(View):
                 res.get('actual_prob', ''),
                 res.get('ev', ''),
             ]
-            ws.append(row)
-
-        # автоширина
-        for col in ws.columns:
-            max_len = 0
-            col_letter = col[0].column_letter
-            for cell in col:
-                if cell.value and len(str(cell.value)) > max_len:
-                    max_len = len(str(cell.value))
-            ws.column_dimensions[col_letter].width = min(max_len + 2, 30)
+            rows.append(row)
+
+        wb = build_export_workbook("Анализ матчей", rows, header_row=0)
 
         response = HttpResponse(
             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -97,6 +97,23 @@ DATABASES = {
     }
 }
 
+# Кэш: default — справочники в памяти процесса (короткий таймаут: сигналы сбрасывают
+# только свой процесс),
+# analysis — результаты анализа пользователя в файлах, общие для всех воркеров gunicorn
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analysis': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'analysis',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators